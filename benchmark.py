@@ -0,0 +1,442 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from file_transfer import COPY_MODE, TRANSFER_MODES
+from typing import Dict, List, Optional
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+BENCHMARKS = ['mp3', 'images', 'decode']
+DEFAULT_SIZES = [1000]  # 100000 and 1000000 take minutes to hours
+DEFAULT_SEED = 1
+DEFAULT_TOLERANCE = 0.1  # Allowed files/s drop against a baseline
+DEFAULT_RSS_TOLERANCE = 0.2  # Allowed peak RSS growth against a baseline
+DEFAULT_SYSCALL_TOLERANCE = 0.1  # Allowed read/write syscall growth against a baseline
+FILES_PER_DIR = 1000  # Corpora are sharded, huge flat folders are unrealistic
+CORPUS_MARKER = '.corpus.json'
+
+# Synthetic MP3 tags, enough variety for every sort folder shape
+GENRES = [f'Genre {i}' for i in range(20)]
+ARTISTS = [f'Artist {i}' for i in range(200)]
+ALBUMS = [f'Album {i}' for i in range(500)]
+MP3_FRAME_SYNC = b'\xff\xfb\x90\x64'
+
+# Synthetic image (width, height) templates, encoded once and reused
+IMAGE_SIZES = [
+    (1920, 1080), (1280, 720), (3840, 2160), (2560, 1080), (1080, 1920),
+    (800, 600), (1024, 1024), (640, 480), (4000, 3000), (300, 200),
+]
+IMAGE_FORMATS = ['.png', '.jpg']
+
+
+def generate_mp3_corpus(corpus_dir: str, count: int, seed: int) -> None:
+    """
+    Writes count tagged MP3 stubs: ID3v2.3 and v2.4 tags with varied frames
+    (some missing, some with padding), ID3v1-only files that need mutagen,
+    and a few non-mp3 files. Audio payloads are unique per file
+
+    :param corpus_dir: output directory, sharded into FILES_PER_DIR subfolders
+    :param count: number of files
+    :param seed: same seed, same corpus
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        shard_dir = _get_shard_dir(corpus_dir, i)
+        roll = rng.random()
+        if roll < 0.02:
+            with open(os.path.join(shard_dir, f'{i:07d}.txt'), 'w') as f:
+                f.write(f'not an mp3 {i}')
+            continue
+
+        frames = {}
+        if rng.random() > 0.1:
+            frames[b'TCON'] = rng.choice(GENRES)
+        if rng.random() > 0.05:
+            frames[b'TPE1'] = rng.choice(ARTISTS)
+        if rng.random() > 0.7:
+            frames[b'TPE2'] = rng.choice(ARTISTS)
+        if rng.random() > 0.1:
+            frames[b'TALB'] = rng.choice(ALBUMS)
+        audio = MP3_FRAME_SYNC + i.to_bytes(4, 'big') + rng.randbytes(
+            rng.randint(1024, 8192)
+        )
+
+        if roll < 0.07:  # ID3v1 only
+            tag = b''
+            audio += _get_id3v1_tag(frames)
+        else:
+            version = 4 if roll < 0.3 else 3
+            padding = rng.choice([0, 256, 2048])
+            tag = _get_id3v2_tag(frames, version, padding)
+        with open(os.path.join(shard_dir, f'{i:07d}.mp3'), 'wb') as f:
+            f.write(tag + audio)
+
+
+def generate_image_corpus(corpus_dir: str, count: int, seed: int) -> None:
+    """
+    Writes count PNG and JPEG files of IMAGE_SIZES. Each (size, format) is
+    encoded once, files are byte copies, so 1M images stay quick to write
+
+    :param corpus_dir: output directory, sharded into FILES_PER_DIR subfolders
+    :param count: number of files
+    :param seed: same seed, same corpus
+    """
+    from PIL import Image, ImageDraw
+
+    templates = {}
+    for width, height in IMAGE_SIZES:
+        image = Image.new('RGB', (width, height), (40, 90, 160))
+        draw = ImageDraw.Draw(image)
+        for x in range(0, width, max(1, width // 16)):
+            draw.line([(x, 0), (width - x, height)], fill=(220, 180, 40), width=3)
+        for ext in IMAGE_FORMATS:
+            data = io.BytesIO()
+            image.save(data, 'PNG' if ext == '.png' else 'JPEG', quality=85)
+            templates[(width, height, ext)] = data.getvalue()
+
+    rng = random.Random(seed)
+    keys = sorted(templates)
+    for i in range(count):
+        width, height, ext = rng.choice(keys)
+        file_path = os.path.join(_get_shard_dir(corpus_dir, i), f'{i:07d}{ext}')
+        with open(file_path, 'wb') as f:
+            f.write(templates[(width, height, ext)])
+
+
+def prepare_corpus(
+        work_dir: str,
+        kind: str,
+        count: int,
+        seed: int
+    ) -> str:
+    # Reuses a corpus generated earlier with the same parameters
+    corpus_dir = os.path.join(work_dir, f'{kind}_{count}_{seed}', 'source')
+    marker_path = os.path.join(corpus_dir, CORPUS_MARKER)
+    if os.path.isfile(marker_path):
+        return corpus_dir
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    print(f'Generating {count} {kind} files in {corpus_dir}')
+    if kind == 'mp3':
+        generate_mp3_corpus(corpus_dir, count, seed)
+    else:
+        generate_image_corpus(corpus_dir, count, seed)
+    with open(marker_path, 'w') as f:
+        json.dump({'kind': kind, 'count': count, 'seed': seed}, f)
+    return corpus_dir
+
+
+def run_benchmark(name: str, corpus_dir: str, transfer_mode: str) -> Dict:
+    """
+    Runs one benchmark in this process, meant to be called in a fresh
+    subprocess so peak RSS only covers that benchmark
+
+    :param name: one of BENCHMARKS
+    :param corpus_dir: corpus from prepare_corpus
+    :param transfer_mode: file_transfer mode for copying benchmarks
+    :return: {'files', 'seconds', 'files_per_s', 'peak_rss_mb', 'read_write_syscalls', ...}
+    """
+    output_dir = os.path.join(os.path.dirname(corpus_dir), 'output')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    file_paths = [
+        os.path.join(d, f)
+        for d, _, files in os.walk(corpus_dir)
+        for f in files if f != CORPUS_MARKER
+    ]
+
+    syscalls_before = _get_read_write_syscall_count()
+    start = time.perf_counter()
+    # Per-file prints are discarded, the terminal would dominate the timing
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if name == 'mp3':
+            _run_mp3_benchmark(corpus_dir, output_dir, transfer_mode)
+        elif name == 'images':
+            _run_images_benchmark(corpus_dir, output_dir, transfer_mode)
+        else:
+            _run_decode_benchmark(sorted(file_paths))
+    seconds = time.perf_counter() - start
+    syscalls_after = _get_read_write_syscall_count()
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    syscalls = None
+    if syscalls_before is not None and syscalls_after is not None:
+        syscalls = syscalls_after - syscalls_before
+    return {
+        'benchmark': name,
+        'files': len(file_paths),
+        'seconds': round(seconds, 3),
+        'files_per_s': round(len(file_paths) / max(seconds, 1e-9), 1),
+        'peak_rss_mb': _get_peak_rss_mb(),
+        'read_write_syscalls': syscalls,
+    }
+
+
+def compare_to_baseline(
+        results: List[Dict],
+        baseline: List[Dict],
+        tolerance: float = DEFAULT_TOLERANCE,
+        rss_tolerance: float = DEFAULT_RSS_TOLERANCE,
+        syscall_tolerance: float = DEFAULT_SYSCALL_TOLERANCE
+    ) -> List[str]:
+    # Returns one message per benchmark slower than baseline * (1 - tolerance)
+    # or above baseline * (1 + tolerance) in peak RSS or read/write syscalls
+    baseline_results = {(r['benchmark'], r['files']): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result['benchmark'], result['files'])
+        if key not in baseline_results:
+            continue
+        name = f'{result["benchmark"]} ({result["files"]} files)'
+        base = baseline_results[key]
+        if result['files_per_s'] < base['files_per_s'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: {result["files_per_s"]} files/s, baseline {base["files_per_s"]}'
+            )
+        for field, unit, field_tolerance in (
+            ('peak_rss_mb', 'MB peak RSS', rss_tolerance),
+            ('read_write_syscalls', 'read/write syscalls', syscall_tolerance),
+        ):
+            # Missing on some platforms and in baselines from older runs
+            if result.get(field) is None or base.get(field) is None:
+                continue
+            if result[field] > base[field] * (1 + field_tolerance):
+                regressions.append(f'{name}: {result[field]} {unit}, baseline {base[field]}')
+    return regressions
+
+
+def _run_mp3_benchmark(corpus_dir: str, output_dir: str, transfer_mode: str) -> None:
+    from mp3_file_sorter import MP3FileSorter
+
+    sorter = MP3FileSorter(transfer_mode=transfer_mode, recursive=True)
+    sorter.SOURCE = corpus_dir
+    sorter.DESTINATION = output_dir
+    sorter.sort_from_source()
+
+
+def _run_images_benchmark(
+        corpus_dir: str,
+        output_dir: str,
+        transfer_mode: str
+    ) -> None:
+    from group_images_by_aspect_ratio import (
+        group_images_by_aspect_ratio,
+        SUBDIR_NAMES,
+    )
+
+    # Works on the current directory, run from the corpus parent directory.
+    # Its output subdirectories are removed again afterwards
+    curr_dir = os.getcwd()
+    os.chdir(os.path.dirname(corpus_dir))
+    try:
+        group_images_by_aspect_ratio(
+            transfer_mode=transfer_mode,
+            recursive=True,
+            exclude=[os.path.basename(output_dir)],
+            extra_targets=[(2560, 1080), (1080, 1920)],
+        )
+    finally:
+        for subdir in SUBDIR_NAMES:
+            shutil.rmtree(subdir, ignore_errors=True)
+        os.chdir(curr_dir)
+
+
+def _run_decode_benchmark(file_paths: List[str]) -> None:
+    # Same decode and scale path the ImageBucketSorter viewer walks through
+    from image_bucket_sorter import IMG_MAX_HEIGHT, IMG_MAX_WIDTH
+    from image_prefetcher import ImagePrefetcher
+
+    prefetcher = ImagePrefetcher(file_paths, IMG_MAX_WIDTH, IMG_MAX_HEIGHT)
+    try:
+        for i in range(len(file_paths)):
+            prefetcher.get(i)
+    finally:
+        prefetcher.close()
+
+
+def _get_shard_dir(corpus_dir: str, index: int) -> str:
+    shard_dir = os.path.join(corpus_dir, f'{index // FILES_PER_DIR:04d}')
+    if index % FILES_PER_DIR == 0:
+        os.makedirs(shard_dir, exist_ok=True)
+    return shard_dir
+
+
+def _get_id3v2_tag(frames: Dict[bytes, str], version: int, padding: int) -> bytes:
+    data = b''
+    for frame_id, text in frames.items():
+        if version == 4:
+            body = b'\x03' + text.encode('utf-8')
+            size = _get_syncsafe(len(body))
+        else:
+            body = b'\x00' + text.encode('latin-1')
+            size = len(body).to_bytes(4, 'big')
+        data += frame_id + size + b'\x00\x00' + body
+    data += b'\x00' * padding
+    return b'ID3' + bytes([version, 0, 0]) + _get_syncsafe(len(data)) + data
+
+
+def _get_id3v1_tag(frames: Dict[bytes, str]) -> bytes:
+    def field(frame_id: bytes) -> bytes:
+        return frames.get(frame_id, '').encode('latin-1')[:30].ljust(30, b'\x00')
+    # title, artist, album, year, comment, genre (255 = none)
+    return (
+        b'TAG' + field(b'TIT2') + field(b'TPE1') + field(b'TALB')
+        + b'2000' + b'\x00' * 30 + b'\xff'
+    )
+
+
+def _get_syncsafe(value: int) -> bytes:
+    return bytes([(value >> shift) & 0x7F for shift in (21, 14, 7, 0)])
+
+
+def _get_read_write_syscall_count() -> Optional[int]:
+    # syscr + syscw only, other syscalls are not counted (Linux only)
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['syscr']) + int(counters['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _get_peak_rss_mb() -> Optional[float]:
+    # VmHWM first, ru_maxrss keeps the parent's peak across exec on Linux
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # Bytes on macOS, KiB elsewhere
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time the sorters on synthetic MP3 and image corpora'
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='append',
+        choices=BENCHMARKS,
+        help='benchmark to run (repeatable), all by default',
+    )
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=DEFAULT_SIZES,
+        help='corpus sizes in files, e.g. 1000 100000 1000000',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=DEFAULT_SEED,
+        help='corpus seed, the same seed always generates the same files',
+    )
+    parser.add_argument(
+        '--work-dir',
+        help='keeps corpora here between runs, a temporary directory by default',
+    )
+    parser.add_argument(
+        '--transfer',
+        choices=TRANSFER_MODES,
+        default=COPY_MODE,
+        help='file_transfer mode used by the copying benchmarks',
+    )
+    parser.add_argument(
+        '--output',
+        help='write results to this JSON file',
+    )
+    parser.add_argument(
+        '--baseline',
+        help='results JSON of an earlier run, slower benchmarks fail the run',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help='allowed files/s drop against --baseline, 0.1 is 10%%',
+    )
+    parser.add_argument(
+        '--rss-tolerance',
+        type=float,
+        default=DEFAULT_RSS_TOLERANCE,
+        help='allowed peak RSS growth against --baseline, 0.2 is 20%%',
+    )
+    parser.add_argument(
+        '--syscall-tolerance',
+        type=float,
+        default=DEFAULT_SYSCALL_TOLERANCE,
+        help='allowed read/write syscall growth against --baseline, 0.1 is 10%%',
+    )
+    parser.add_argument('--run-one', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:  # Subprocess mode, prints one JSON result
+        name, corpus_dir = args.run_one
+        print(json.dumps(run_benchmark(name, corpus_dir, args.transfer)))
+        raise SystemExit(0)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='sorter_benchmark_')
+    results = []
+    for count in args.sizes:
+        for name in args.benchmark or BENCHMARKS:
+            kind = 'mp3' if name == 'mp3' else 'images'
+            corpus_dir = prepare_corpus(work_dir, kind, count, args.seed)
+            completed = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__),
+                    '--run-one', name, corpus_dir, '--transfer', args.transfer,
+                ],
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                print(f'{name} ({count} files) failed:\n{completed.stderr}')
+                continue
+            result = json.loads(completed.stdout.splitlines()[-1])
+            results.append(result)
+            print(
+                f'{name:>8} {result["files"]:>9} files  '
+                f'{result["files_per_s"]:>10.1f} files/s  '
+                f'peak RSS {result["peak_rss_mb"]} MB  '
+                f'read/write syscalls {result["read_write_syscalls"]}'
+            )
+
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_to_baseline(
+                results,
+                json.load(f),
+                args.tolerance,
+                args.rss_tolerance,
+                args.syscall_tolerance,
+            )
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,226 @@
+import operator
+import os
+import re
+
+from concurrent.futures import ThreadPoolExecutor
+from image_probe import probe_image_size
+from itertools import islice
+from PIL import ExifTags, Image
+from typing import Callable, Dict, Iterable, List, Optional
+
+DEFAULT_RULES_FILE_NAME = 'image_bucket_rules.txt'
+DEFAULT_RULE_WORKERS = 8
+RULE_BATCH_SIZE = 1024  # Images submitted to the workers at a time
+
+NUMERIC_FIELDS = ['width', 'height', 'aspect_ratio', 'file_size']
+TEXT_FIELDS = ['extension']
+EXIF_PREFIX = 'exif.'  # exif.Model, exif.DateTimeOriginal, ...
+EXIF_IFD_TAG = 0x8769
+CONDITION_SEPARATOR = 'and'
+
+# Quoted values may hold spaces and the word 'and', "..." or '...'
+TOKEN_PATTERN = re.compile(r'"([^"]*)"|\'([^\']*)\'|(\S+)')
+
+OPERATORS: Dict[str, Callable] = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '~': lambda value, expected: expected in value,  # Text contains
+}
+ORDERING_OPERATORS = ['<', '<=', '>', '>=']  # Numeric on EXIF numbers
+
+
+class Condition:
+    def __init__(self, field: str, op: str, value: str) -> None:
+        self.field = field
+        self.op = op
+        self.compare = OPERATORS[op]
+        self.number = None  # EXIF threshold, compared as a number
+        if field in NUMERIC_FIELDS:
+            self.value = float(value)
+        else:
+            self.value = value.lower()
+            if op in ORDERING_OPERATORS:
+                self.number = _to_number(value)
+
+    def matches(self, fields: Dict[str, object]) -> bool:
+        value = fields.get(self.field)
+        if value is None:  # Missing EXIF tags never match
+            return False
+        if self.number is not None:
+            number = _to_number(value)
+            if number is not None:  # ISO 1600 >= 800, not '1600' >= '800'
+                return self.compare(number, self.number)
+        if self.field not in NUMERIC_FIELDS:
+            value = str(value).lower()
+        try:
+            return self.compare(value, self.value)
+        except TypeError:
+            return False
+
+
+class Rule:
+    def __init__(self, bucket: str, conditions: List[Condition]) -> None:
+        self.bucket = bucket
+        self.conditions = conditions
+
+    def matches(self, fields: Dict[str, object]) -> bool:
+        return all(c.matches(fields) for c in self.conditions)
+
+
+def read_rules(rules_path: str, bucket_names: List[str]) -> List[Rule]:
+    """
+    Reads auto-bucketing rules, one per line, the first matching rule wins
+
+        # comment
+        wallpapers: width >= 1920 and aspect_ratio >= 1.7 and aspect_ratio <= 1.8
+        small: width < 800
+        pngs: extension == .png
+        phone: exif.Model ~ iphone
+        studio: exif.Artist == "Smith and Sons"
+
+    Fields: NUMERIC_FIELDS (file_size in bytes), TEXT_FIELDS and
+    EXIF_PREFIX + any Pillow ExifTags name. Operators: OPERATORS, '~' means
+    contains (text fields only). Text comparisons ignore case, ordering
+    operators compare EXIF values as numbers when both sides are numbers.
+    Quote values that contain ' and ' or several spaces.
+
+    :param rules_path: rules file path
+    :param bucket_names: configured buckets, rules may only use these
+    :return: rules in file order
+    :raises ValueError: on the first invalid line
+    """
+    rules = []
+    with open(rules_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                rules.append(_parse_rule(line, bucket_names))
+            except ValueError as e:
+                raise ValueError(f'{rules_path}:{line_number}: {e}')
+    return rules
+
+
+def get_image_fields(file_path: str, need_exif: bool) -> Dict[str, object]:
+    # Only headers are read, EXIF only when a rule needs it
+    width, height = probe_image_size(file_path)
+    fields = {
+        'width': width,
+        'height': height,
+        'aspect_ratio': width / height if height else None,
+        'file_size': os.stat(file_path).st_size,
+        'extension': os.path.splitext(file_path)[1].lower(),
+    }
+    if need_exif:
+        with Image.open(file_path) as image:
+            exif = image.getexif()
+            tags = dict(exif)
+            tags.update(exif.get_ifd(EXIF_IFD_TAG))
+        for tag, value in tags.items():
+            fields[EXIF_PREFIX + ExifTags.TAGS.get(tag, str(tag))] = value
+    return fields
+
+
+def match_image(file_path: str, rules: List[Rule]) -> Optional[str]:
+    # Bucket of the first matching rule, None if no rule matches or the
+    # image cannot be read (it is then left for manual sorting)
+    need_exif = any(
+        c.field.startswith(EXIF_PREFIX) for r in rules for c in r.conditions
+    )
+    try:
+        fields = get_image_fields(file_path, need_exif)
+    except Exception:
+        return None
+    for rule in rules:
+        if rule.matches(fields):
+            return rule.bucket
+    return None
+
+
+def auto_bucket_images(
+        curr_dir: str,
+        image_names: Iterable[str],
+        rules: List[Rule],
+        workers: int = DEFAULT_RULE_WORKERS,
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> Dict[str, str]:
+    """
+    Matches images against the rules on a pool of threads
+
+    :param curr_dir: directory holding the images
+    :param image_names: image file names in curr_dir
+    :param rules: rules from read_rules
+    :param workers: matching threads
+    :param on_progress: called with the amount of images matched so far
+                        after every RULE_BATCH_SIZE batch
+    :return: {image name: bucket} for every image a rule matched
+    """
+    decisions = {}
+    done_count = 0
+    names = iter(image_names)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        batch = list(islice(names, RULE_BATCH_SIZE))
+        while batch:
+            buckets = executor.map(
+                lambda name: match_image(os.path.join(curr_dir, name), rules),
+                batch,
+            )
+            for name, bucket in zip(batch, buckets):
+                if bucket is not None:
+                    decisions[name] = bucket
+            done_count += len(batch)
+            if on_progress is not None:
+                on_progress(done_count)
+            batch = list(islice(names, RULE_BATCH_SIZE))
+    return decisions
+
+
+def _parse_rule(line: str, bucket_names: List[str]) -> Rule:
+    bucket, sep, conditions_str = line.partition(':')
+    bucket = bucket.strip()
+    if not sep or bucket not in bucket_names:
+        raise ValueError(f'expected "<bucket>: <conditions>", buckets: {bucket_names}')
+
+    conditions = []
+    for parts in _split_conditions(conditions_str):
+        if len(parts) < 3 or parts[1] not in OPERATORS:
+            raise ValueError(f'expected "<field> <{"|".join(OPERATORS)}> <value>"')
+        field, op, value = parts[0], parts[1], ' '.join(parts[2:])
+        known = field in NUMERIC_FIELDS or field in TEXT_FIELDS
+        if not known and not field.startswith(EXIF_PREFIX):
+            raise ValueError(f'unknown field {field}')
+        if field in NUMERIC_FIELDS and op == '~':
+            raise ValueError(f'~ only applies to text fields, not {field}')
+        conditions.append(Condition(field, op, value))
+    return Rule(bucket, conditions)
+
+
+def _to_number(value: object) -> Optional[float]:
+    # EXIF numbers come as int, float, IFDRational or text, None otherwise
+    try:
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _split_conditions(conditions_str: str) -> List[List[str]]:
+    # Tokens of every condition, split on unquoted CONDITION_SEPARATOR words
+    conditions = [[]]
+    for match in TOKEN_PATTERN.finditer(conditions_str):
+        double_quoted, single_quoted, word = match.groups()
+        if word is None:
+            conditions[-1].append(
+                double_quoted if double_quoted is not None else single_quoted
+            )
+        elif word[0] in '"\'':
+            raise ValueError(f'unterminated quote in {conditions_str.strip()}')
+        elif word == CONDITION_SEPARATOR:
+            conditions.append([])
+        else:
+            conditions[-1].append(word)
+    return conditions
@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+import time
+
+from file_transfer import FileTransfer
+from run_metrics import RunMetrics
+from typing import Callable, List, Optional
+
+DEFAULT_COPY_WORKERS = 4
+QUEUED_COPIES_PER_WORKER = 64  # Bounds memory, submit() blocks when full
+
+# Called from a worker thread as on_copied(src, dst_dir, error), one at a time
+CopiedCallback = Callable[[str, str, Optional[Exception]], None]
+
+
+class CopyPipeline:
+    """
+    Copies files on a pool of worker threads fed by a bounded queue, so the
+    producer (probing, classifying, UI) keeps running while copies are done.
+
+    With workers=0 copies run synchronously inside submit().
+
+    NOTE: Only copies, never moves, through FileTransfer
+    NOTE: on_copied runs on a worker thread, it must not touch Tk widgets
+    NOTE: With metrics, copies are timed as the 'copy' stage and counted as
+          files_copied, bytes_copied and copy_errors
+    """
+    def __init__(
+            self,
+            file_transfer: FileTransfer,
+            workers: int = DEFAULT_COPY_WORKERS,
+            on_copied: Optional[CopiedCallback] = None,
+            metrics: Optional[RunMetrics] = None,
+        ) -> None:
+        self.file_transfer = file_transfer
+        self.metrics = metrics
+        self.on_copied = on_copied
+        self.copied_count = 0
+        self.copied_bytes = 0
+        self.error_count = 0
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+        self._lock = threading.Lock()
+        max_queued = max(1, workers) * QUEUED_COPIES_PER_WORKER
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._workers: List[threading.Thread] = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self._run_worker, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, src: str, dst_dir: str) -> None:
+        if self._workers:
+            self._queue.put((src, dst_dir))
+        else:
+            self._copy(src, dst_dir)
+
+    def get_pending_count(self) -> int:
+        # Approximate, copies queued or in progress
+        return self._queue.unfinished_tasks
+
+    def close(self) -> None:
+        # Waits for every queued copy to finish, then stops the workers
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self.end_time = time.perf_counter()
+
+    def get_throughput_str(self) -> str:
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        elapsed = max(elapsed, 1e-9)
+        mb = self.copied_bytes / (1024 * 1024)
+        return (
+            f'{self.copied_count} files ({mb:.1f} MB) copied in '
+            f'{elapsed:.2f}s: {self.copied_count / elapsed:.1f} files/s, '
+            f'{mb / elapsed:.1f} MB/s, {self.error_count} errors'
+        )
+
+    def _run_worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._copy(*item)
+            finally:
+                self._queue.task_done()
+
+    def _copy(self, src: str, dst_dir: str) -> None:
+        error = None
+        try:
+            if self.metrics is not None:
+                with self.metrics.stage('copy'):
+                    self.file_transfer.transfer(src, dst_dir)
+            else:
+                self.file_transfer.transfer(src, dst_dir)
+            size = os.stat(src).st_size
+        except Exception as e:
+            error = e
+        if self.metrics is not None:
+            if error is None:
+                self.metrics.count('files_copied')
+                self.metrics.count('bytes_copied', size)
+            else:
+                self.metrics.count('copy_errors')
+        with self._lock:
+            if error is None:
+                self.copied_count += 1
+                self.copied_bytes += size
+            else:
+                self.error_count += 1
+            if self.on_copied is not None:  # Serialized, keeps output tidy
+                self.on_copied(src, dst_dir, error)
@@ -0,0 +1,175 @@
+import os
+import sys
+
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+UNKNOWN = -1  # Width, height or bucket id not recorded
+FS_ENCODING = sys.getfilesystemencoding()  # Names are stored os.fsencode()d
+FS_ERRORS = sys.getfilesystemencodeerrors()
+
+
+class FileCatalog:
+    """
+    Compact column store of file records for multi-million-file runs.
+
+    Directories and bucket labels are interned once, names live in a single
+    byte buffer and width, height and bucket id are typed array columns, so
+    a record costs a few bytes plus its name instead of several Python
+    objects.
+
+    - bucket_ids -:> one label per file (e.g. a destination folder), any
+      number of distinct labels
+    - add_to_bucket -:> membership bitmaps, one bit per file per bucket,
+      kept exact through undos and replays, read with count_bucket
+
+    NOTE: Paths are rebuilt on access with os.path.join, nothing is cached
+    NOTE: Records are append-only, use select() to drop some
+    NOTE: Not thread-safe, fill it from one thread
+    """
+    def __init__(self) -> None:
+        self.dirs: List[str] = []
+        self.labels: List[str] = []
+        self._dir_ids: Dict[str, int] = {}
+        self._label_ids: Dict[str, int] = {}
+        self._bitmaps: Dict[str, bytearray] = {}
+
+        # Columns, one entry per file
+        self.dir_ids = array('I')
+        self.name_ends = array('Q')  # End offsets into _name_data
+        self.widths = array('i')
+        self.heights = array('i')
+        self.bucket_ids = array('i')
+        self._name_data = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.dir_ids)
+
+    def __getitem__(self, index: int) -> str:
+        return self.get_path(index)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.get_path(i)
+
+    def add(
+            self,
+            path: str,
+            width: int = UNKNOWN,
+            height: int = UNKNOWN,
+            bucket: Optional[str] = None
+        ) -> int:
+        """
+        Appends a record
+
+        :param path: file path, relative paths stay relative
+        :param width: image width in pixels
+        :param height: image height in pixels
+        :param bucket: bucket label, see set_bucket
+        :return: index of the new record
+        """
+        directory, name = os.path.split(path)
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+
+        self._name_data += os.fsencode(name)
+        self.dir_ids.append(dir_id)
+        self.name_ends.append(len(self._name_data))
+        self.widths.append(width)
+        self.heights.append(height)
+        self.bucket_ids.append(self._get_label_id(bucket))
+        return len(self.dir_ids) - 1
+
+    def add_entry(self, entry: os.DirEntry, relative: bool = False) -> int:
+        # relative keeps only the entry name
+        return self.add(entry.name if relative else entry.path)
+
+    def get_name(self, index: int) -> str:
+        # Decoded straight from the buffer, the view is released on return.
+        # Negative indexes count from the end like the array columns do
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('catalog index out of range')
+        start =self.name_ends[index - 1] if index > 0 else 0
+        end = self.name_ends[index]
+        with memoryview(self._name_data) as names:
+            return str(names[start:end], FS_ENCODING, FS_ERRORS)
+
+    def get_dir(self, index: int) -> str:
+        return self.dirs[self.dir_ids[index]]
+
+    def get_path(self, index: int) -> str:
+        return os.path.join(self.dirs[self.dir_ids[index]], self.get_name(index))
+
+    def get_bucket(self, index: int) -> Optional[str]:
+        bucket_id = self.bucket_ids[index]
+        return None if bucket_id == UNKNOWN else self.labels[bucket_id]
+
+    def set_bucket(self, index: int, bucket: Optional[str]) -> None:
+        self.bucket_ids[index] = self._get_label_id(bucket)
+
+    def items(self) -> Iterator[Tuple[str, Optional[str]]]:
+        # (path, bucket label) pairs in record order
+        for i in range(len(self)):
+            yield self.get_path(i), self.get_bucket(i)
+
+    def add_to_bucket(self, index: int, bucket: str) -> None:
+        bitmap = self._bitmaps.setdefault(bucket, bytearray())
+        byte_index = index >> 3
+        if byte_index >= len(bitmap):
+            bitmap.extend(bytes(byte_index + 1 - len(bitmap)))
+        bitmap[byte_index] |= 1 << (index & 7)
+
+    def remove_from_bucket(self, index: int, bucket: str) -> None:
+        bitmap = self._bitmaps.get(bucket)
+        if bitmap is not None and index >> 3 < len(bitmap):
+            bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def count_bucket(self, bucket: str) -> int:
+        bitmap = self._bitmaps.get(bucket, b'')
+        return int.from_bytes(bitmap, 'little').bit_count()
+
+    def select(self, indexes: Iterable[int]) -> 'FileCatalog':
+        # New catalog holding only these records, in this order. Bucket
+        # labels are kept, membership bitmaps are not
+        selected = FileCatalog()
+        for i in indexes:
+            selected.add(
+                self.get_path(i),
+                self.widths[i],
+                self.heights[i],
+                self.get_bucket(i),
+            )
+        return selected
+
+    def _get_label_id(self, label: Optional[str]) -> int:
+        if label is None:
+            return UNKNOWN
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            label_id = self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return label_id
+
+
+class CatalogPaths(Sequence[str]):
+    """
+    Read-only list of catalog paths picked by an index array, so an ordering
+    or filtered view costs 4 bytes per file
+    """
+    __slots__ = ('catalog', 'indexes')
+
+    def __init__(self, catalog: FileCatalog, indexes: array) -> None:
+        self.catalog = catalog
+        self.indexes = indexes
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.catalog.get_path(i) for i in self.indexes[position]]
+        return self.catalog.get_path(self.indexes[position])
@@ -0,0 +1,57 @@
+import os
+
+from fnmatch import fnmatch
+from typing import Iterable, Iterator, List, Optional
+
+
+def scan_files(
+        directory: str,
+        extensions: Optional[Iterable[str]] = None,
+        recursive: bool = False,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> Iterator[os.DirEntry]:
+    """
+    Lazily yields a DirEntry for every file under directory.
+
+    Uses os.scandir so file/dir checks come from the cached entry type
+    instead of an extra stat per entry. Entries are yielded as each directory
+    is read, nothing is listed up front.
+
+    NOTE: Symlinked directories are not followed to avoid cycles
+    NOTE: Order within a directory is the order the OS returns
+
+    :param directory: root directory to scan
+    :param extensions: only yield files with these extensions (any case)
+    :param recursive: also scan subdirectories
+    :param exclude: glob patterns matched against names and paths relative to
+                    directory, matching files are skipped and matching
+                    directories are not entered
+    :return: iterator of os.DirEntry
+    """
+    if extensions is not None:
+        extensions = {e.lower() for e in extensions}
+    exclude = list(exclude or [])
+
+    pending_dirs = [directory]
+    while pending_dirs:
+        curr_dir = pending_dirs.pop()
+        with os.scandir(curr_dir) as entries:
+            for entry in entries:
+                if exclude and _is_excluded(entry, directory, exclude):
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending_dirs.append(entry.path)
+                elif entry.is_file():
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if extensions is None or ext in extensions:
+                        yield entry
+
+
+def _is_excluded(entry: os.DirEntry, root: str, exclude: List[str]) -> bool:
+    rel_path = os.path.relpath(entry.path, root)
+    return any(
+        fnmatch(entry.name, pattern) or fnmatch(rel_path, pattern)
+        for pattern in exclude
+    )
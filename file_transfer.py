@@ -0,0 +1,164 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+
+from typing import Dict, List, Set, Tuple
+
+# Transfer modes, 'auto' tries every mode that creates an independent copy
+COPY_MODE = 'copy'
+HARDLINK_MODE = 'hardlink'
+REFLINK_MODE = 'reflink'
+KERNEL_MODE = 'kernel'
+AUTO_MODE = 'auto'
+TRANSFER_MODES = [AUTO_MODE, COPY_MODE, HARDLINK_MODE, REFLINK_MODE, KERNEL_MODE]
+FALLBACK_ORDER = [REFLINK_MODE, KERNEL_MODE, COPY_MODE]
+
+FICLONE = 0x40049409  # Linux ioctl, shares extents on btrfs/xfs/...
+KERNEL_CHUNK_SIZE = 64 * 1024 * 1024
+MTIME_TOLERANCE = 2.0  # Seconds, FAT stores mtimes in 2 second steps
+
+# errno values meaning "this filesystem pair cannot do it", not a real error
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EPERM,
+    errno.EMLINK, errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+    errno.ENOTSOCK,
+}
+
+
+class FileTransfer:
+    """
+    Copies files with the cheapest mode the source and destination
+    filesystems support, falling back to shutil.copy2.
+
+    - COPY_MODE -:> shutil.copy2, every byte is duplicated
+    - HARDLINK_MODE -:> os.link, same inode (edits show up in both places)
+    - REFLINK_MODE -:> copy-on-write clone (FICLONE), Linux only
+    - KERNEL_MODE -:> os.copy_file_range or os.sendfile (Linux only, other
+      systems only send to sockets), no user space buffer
+    - AUTO_MODE -:> REFLINK_MODE, then KERNEL_MODE, then COPY_MODE
+
+    NOTE: Never moves or deletes a source file, a partial destination left by
+          a failed mode is removed before the next mode is tried
+    NOTE: Unsupported modes are remembered per (source, destination) device
+    NOTE: Safe to share between threads
+    """
+    def __init__(self, mode: str = COPY_MODE) -> None:
+        if mode not in TRANSFER_MODES:
+            raise ValueError(f'Unknown transfer mode {mode}: {TRANSFER_MODES}')
+        self.mode = mode
+        self.unsupported: Dict[Tuple[int, int], Set[str]] = {}
+        self.mode_counts = {m: 0 for m in TRANSFER_MODES}
+        self._lock = threading.Lock()
+
+    def transfer(self, src: str, dst: str) -> str:
+        """
+        Same call signature as shutil.copy2, dst may be a directory
+
+        :param src: source file path
+        :param dst: destination file or directory path
+        :return: destination file path
+        """
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            # Opening dst for writing would truncate the source
+            raise shutil.SameFileError(f'{src} and {dst} are the same file')
+        dst_dir = os.path.dirname(dst) or '.'
+        devices = (os.stat(src).st_dev, os.stat(dst_dir).st_dev)
+        with self._lock:
+            unsupported = self.unsupported.setdefault(devices, set())
+
+        for mode in self.get_mode_order(devices):
+            if mode in unsupported:
+                continue
+            try:
+                self._transfer_with(mode, src, dst)
+            except FileExistsError:
+                continue  # Hardlink onto an existing file, copy over it
+            except OSError as e:
+                if mode == COPY_MODE or e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                with self._lock:
+                    unsupported.add(mode)
+                continue
+            with self._lock:
+                self.mode_counts[mode] += 1
+            return dst
+        raise OSError(f'No transfer mode could copy {src} to {dst}')
+
+    def get_mode_order(self, devices: Tuple[int, int]) -> List[str]:
+        if self.mode == AUTO_MODE:
+            order = list(FALLBACK_ORDER)
+        else:
+            order = [self.mode] + [m for m in FALLBACK_ORDER if m != self.mode]
+        if devices[0] != devices[1]:  # Links and clones never cross devices
+            order = [m for m in order if m not in (HARDLINK_MODE, REFLINK_MODE)]
+        return order
+
+    def _transfer_with(self, mode: str, src: str, dst: str) -> None:
+        if mode == COPY_MODE:
+            shutil.copy2(src, dst)
+        elif mode == HARDLINK_MODE:
+            os.link(src, dst)
+        else:
+            try:
+                if mode == REFLINK_MODE:
+                    _reflink(src, dst)
+                else:
+                    _kernel_copy(src, dst)
+                shutil.copystat(src, dst)
+            except OSError:
+                if os.path.exists(dst):
+                    os.remove(dst)
+                raise
+
+
+def is_complete_copy(src: str, dst: str) -> bool:
+    """
+    Checks whether dst is a finished transfer of src. Every mode sets the
+    source mtime last, so a copy cut short by a crash keeps a newer mtime
+    (or a different size) and fails this check
+
+    :param src: source file path
+    :param dst: destination file path
+    :return: False if dst is missing, of another size or mtime
+    """
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    return (
+        src_stat.st_size == dst_stat.st_size
+        and abs(src_stat.st_mtime - dst_stat.st_mtime) <= MTIME_TOLERANCE
+    )
+
+
+def _reflink(src: str, dst: str) -> None:
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        raise OSError(errno.EOPNOTSUPP, 'reflink not supported')
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _kernel_copy(src: str, dst: str) -> None:
+    copy_range = getattr(os, 'copy_file_range', None)
+    has_sendfile = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+    if copy_range is None and not has_sendfile:
+        raise OSError(errno.ENOSYS, 'no kernel copy available')
+
+    size = os.stat(src).st_size
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        offset = 0
+        while offset < size:
+            count = min(KERNEL_CHUNK_SIZE, size - offset)
+            if copy_range is not None:
+                sent = copy_range(fsrc.fileno(), fdst.fileno(), count)
+            else:
+                sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, count)
+            if sent == 0:  # Some filesystems report success without copying
+                raise OSError(errno.EINVAL, 'kernel copy made no progress')
+            offset += sent
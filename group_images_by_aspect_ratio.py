@@ -1,19 +1,64 @@
+import argparse
 import os
-import sys
-from shutil import copy2
 
-from PIL import Image, UnidentifiedImageError
+import numpy as np
 
-VALID_IMAGE_EXTENSIONS = ['.png', '.jpeg', 'jpg']
+from copy_pipeline import CopyPipeline, DEFAULT_COPY_WORKERS
+from file_catalog import FileCatalog
+from file_scanner import scan_files
+from file_transfer import COPY_MODE, FileTransfer, TRANSFER_MODES
+from image_dedup import (
+	DEDUP_BUCKET,
+	DEDUP_MODES,
+	DEFAULT_HASH_CACHE_FILE_NAME,
+	DEFAULT_MAX_DISTANCE,
+	DuplicateFinder,
+	DUPLICATES_DIR_NAME
+)
+from image_manifest import DEFAULT_MANIFEST_FILE_NAME, ImageManifest
+from image_probe import probe_image_size
+from itertools import chain, islice
+from PIL import UnidentifiedImageError
+from run_metrics import (
+	add_metrics_arguments,
+	profile_run,
+	RunMetrics,
+	write_metrics
+)
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+VALID_IMAGE_EXTENSIONS = ['.png', '.jpeg', '.jpg']
 SMALL_DIR_NAME = 'too_small'
 CORRECT_DIR_NAME = 'correct_aspect_ratio'
 LARGE_DIR_NAME = 'too_large'
 
+# Classification codes, index into SUBDIR_NAMES
+SMALL_CODE = 0
+CORRECT_CODE = 1
+LARGE_CODE = 2
+SUBDIR_NAMES = [SMALL_DIR_NAME, CORRECT_DIR_NAME, LARGE_DIR_NAME]
+
+# Images probed before each vectorized classification pass
+CLASSIFY_BATCH_SIZE = 4096
+METRICS_NAME = 'group_images'
+
 
 def group_images_by_aspect_ratio(
 		width: int = 1920,
 		height: int = 1080,
-		error_margin: float = .01
+		error_margin: float = .01,
+		transfer_mode: str = COPY_MODE,
+		recursive: bool = False,
+		exclude: Optional[List[str]] = None,
+		use_exif_orientation: bool = False,
+		extra_targets: Optional[List[Tuple[int, int]]] = None,
+		match_all: bool = False,
+		copy_workers: int = DEFAULT_COPY_WORKERS,
+		manifest_path: Optional[str] = None,
+		dedup_mode: Optional[str] = None,
+		dedup_distance: int = DEFAULT_MAX_DISTANCE,
+		metrics: Optional[RunMetrics] = None,
+		verbose: bool = False
 	) -> None:
 	"""
 	Creates COPIES of all images in the current directory and sorts them into
@@ -23,43 +68,73 @@ def group_images_by_aspect_ratio(
 	- /CORRECT_DIR_NAME -:> dimensions are within error margin of desired ratio
 	- /SMALL_DIR_NAME -:> image too large in either direction, can be cropped
 	
+	With extra_targets, every image is checked against every target in one
+	pass and matches go to /CORRECT_DIR_NAME/<width>x<height>. Images that
+	match no target go to /SMALL_DIR_NAME if they are too small for all of
+	them, /LARGE_DIR_NAME otherwise
+	
 	NOTE: Only uses COPY operations in order to avoid file losses
 	NOTE: Prioritizes safety (no file losses) over speed
 	NOTE: Only tested thoroughly on Windows 10 OS
+	NOTE: Dimensions come from image headers, images are never decoded
+	NOTE: Copies run on copy_workers threads while the next images are probed
+	NOTE: With manifest_path, unchanged images are not probed again and copies
+	      already made (and still on disk) are skipped
+	NOTE: With dedup_mode, near-duplicates of an earlier image (perceptual
+	      hash, see image_dedup.py) are skipped or copied to
+	      /DUPLICATES_DIR_NAME instead of being sorted
+	NOTE: Stages (scan, probe, dedup, classify, copy_submit, copy) are timed
+	      in metrics, only errors and a summary are printed unless verbose
 	
 	:param width: width in pixel units
 	:param height: height in pixel units
 	:param error_margin: error margin as a percent of both width and height
+	:param transfer_mode: file_transfer mode, falls back to a full copy
+	:param recursive: also sort images in subdirectories, mirrored under each
+		output subdirectory so equal names never overwrite each other
+	:param exclude: glob patterns of files and subdirectories to skip
+	:param use_exif_orientation: measure images as displayed (EXIF rotated)
+	:param extra_targets: more (width, height) targets to classify against
+	:param match_all: copy to every matching target instead of the best one
+	:param copy_workers: copy threads, 0 copies in between probes
+	:param manifest_path: SQLite manifest for incremental and resumed runs
+	:param dedup_mode: None, DEDUP_SKIP or DEDUP_BUCKET
+	:param dedup_distance: differing hash bits still counted as a duplicate
+	:param metrics: receives stage timings and counters, a new one if None
+	:param verbose: also print a line per copied or duplicate image
 	:return: None
 	"""
 	curr_dir = os.getcwd()
-	target_subdir = None
-	target_aspect_ratio = width / height
-	error_floor = target_aspect_ratio - (target_aspect_ratio * error_margin)
-	error_ceiling = target_aspect_ratio + (target_aspect_ratio * error_margin)
-	
-	all_subdir_names = [
-		f for f in os.listdir(curr_dir)
-		if os.path.isdir(os.path.join(curr_dir, f))
-	]
-	all_file_names = [
-		f for f in os.listdir(curr_dir)
-		if os.path.isfile(os.path.join(curr_dir, f))
-	]
-	image_file_names = filter(
-		lambda x: os.path.splitext(x)[1] in VALID_IMAGE_EXTENSIONS,
-		all_file_names
-	)
+	if metrics is None:
+		metrics = RunMetrics(METRICS_NAME)
+	targets = [(width, height)] + list(extra_targets or [])
+	
+	output_subdirs = list(SUBDIR_NAMES)
+	if len(targets) > 1:
+		output_subdirs += [
+			os.path.join(CORRECT_DIR_NAME, get_target_dir_name(t))
+			for t in targets
+		]
+	if dedup_mode == DEDUP_BUCKET:
+		output_subdirs.append(DUPLICATES_DIR_NAME)
 	
-	if not image_file_names:
+	# Lazy scan, output subdirectories are never re-sorted
+	image_entries = scan_files(
+		curr_dir,
+		VALID_IMAGE_EXTENSIONS,
+		recursive,
+		SUBDIR_NAMES + [DUPLICATES_DIR_NAME] + list(exclude or [])
+	)
+	first_entry = next(image_entries, None)
+	if first_entry is None:
 		print(f'No compatible image files in {curr_dir}')
 		return
 	
 	# Create subdirectories if they do not already exist
-	for subdir in [SMALL_DIR_NAME, CORRECT_DIR_NAME, LARGE_DIR_NAME]:
-		if subdir not in all_subdir_names:
+	for subdir in output_subdirs:
+		if not os.path.isdir(os.path.join(curr_dir, subdir)):
 			try:
-				os.mkdir(os.path.join(curr_dir, subdir))
+				os.makedirs(os.path.join(curr_dir, subdir))
 			except FileExistsError as e:
 				print(f'{subdir} already exists in {curr_dir}: {type(e)} {e}')
 			except FileNotFoundError as e:
@@ -67,39 +142,327 @@ def group_images_by_aspect_ratio(
 			except OSError as e:
 				print(f'OS Exception when creating {subdir}: {type(e)} {e}')
 	
-	for i in image_file_names:
-		try:
-			img_obj = Image.open(os.path.join(curr_dir, i))
-			w, h = img_obj.size
-			aspect_ratio = w / h
-		except FileNotFoundError as e:
-			print(f'File {i} not found: {type(e)} {e}')
-		except UnidentifiedImageError as e:
-			print(f'File {i} cannot be opened or identified: {type(e)} {e}')
-		except (ValueError, TypeError) as e:
-			print(f'Format or type error when opening {i}: {type(e)} {e}')
-		else:
-			
-			if w == width and h == height:
-				target_subdir = CORRECT_DIR_NAME
-			elif w < width or h < height:
-				target_subdir = SMALL_DIR_NAME
-			elif error_floor < aspect_ratio < error_ceiling:
-				target_subdir = CORRECT_DIR_NAME
+	manifest = None
+	if manifest_path is not None:
+		manifest = ImageManifest(manifest_path, curr_dir)
+	
+	def on_copied(src: str, dst_dir: str, e: Optional[Exception]) -> None:
+		if verbose or e is not None:
+			_print_copy_result(curr_dir, src, dst_dir, e)
+		if manifest is not None and e is None:
+			manifest.mark_copied(src, dst_dir)
+	
+	duplicate_finder = None
+	if dedup_mode is not None:
+		duplicate_finder = DuplicateFinder(
+			dedup_distance,
+			cache_path=os.path.join(curr_dir, DEFAULT_HASH_CACHE_FILE_NAME)
+		)
+	
+	copy_pipeline = CopyPipeline(
+		FileTransfer(transfer_mode),
+		copy_workers,
+		on_copied,
+		metrics
+	)
+	skipped_count = 0
+	created_dirs: Set[str] = set()  # Mirrored source subdirectories
+	all_entries = metrics.timed_iter('scan', chain([first_entry], image_entries))
+	for batch in _batched(all_entries, CLASSIFY_BATCH_SIZE):
+		probed = FileCatalog()  # Paths with width and height columns
+		for entry in batch:
+			i = os.path.relpath(entry.path, curr_dir)
+			try:
+				with metrics.stage('probe'):
+					w, h = _probe_entry(entry, manifest, use_exif_orientation)
+			except FileNotFoundError as e:
+				print(f'File {i} not found: {type(e)} {e}')
+			except UnidentifiedImageError as e:
+				print(f'File {i} cannot be opened or identified: {type(e)} {e}')
+			except (ValueError, TypeError) as e:
+				print(f'Format or type error when opening {i}: {type(e)} {e}')
 			else:
-				target_subdir = LARGE_DIR_NAME
-				
-		try:  # No move operations, only copy
-			copy2(
-				os.path.join(curr_dir, i),
-				os.path.join(curr_dir, target_subdir)
+				probed.add(entry.path, width=w, height=h)
+		metrics.count('images_probed', len(probed))
+		metrics.count('probe_errors', len(batch) - len(probed))
+		if duplicate_finder is not None:
+			with metrics.stage('dedup'):
+				originals = duplicate_finder.find_batch(list(probed))
+			unique = []
+			for index, (path, original) in enumerate(zip(probed, originals)):
+				if original is None:
+					unique.append(index)
+					continue
+				metrics.count('duplicates')
+				if verbose:
+					i = os.path.relpath(path, curr_dir)
+					print(f'{i} duplicates {os.path.relpath(original, curr_dir)}')
+				if dedup_mode == DEDUP_BUCKET:
+					dst_dir = _get_dst_dir(
+						curr_dir, DUPLICATES_DIR_NAME, path, created_dirs
+					)
+					if manifest is not None and manifest.is_copied(path, dst_dir):
+						skipped_count += 1
+					else:
+						with metrics.stage('copy_submit'):
+							copy_pipeline.submit(path, dst_dir)
+			probed = probed.select(unique)
+		if not probed:
+			continue
+		
+		with metrics.stage('classify'):
+			codes, errors = classify_sizes(
+				np.frombuffer(probed.widths, dtype=np.intc),  # No copy
+				np.frombuffer(probed.heights, dtype=np.intc),
+				targets,
+				error_margin
 			)
-		except Exception as e:
-			print(f'Exception when copying {i}: {type(e)} {e}')
+			all_target_subdirs = get_target_subdirs(codes, errors, targets, match_all)
+		
+		for path, target_subdirs in zip(probed, all_target_subdirs):
+			for target_subdir in target_subdirs:  # No move operations, only copy
+				dst_dir = _get_dst_dir(curr_dir, target_subdir, path, created_dirs)
+				if manifest is not None and manifest.is_copied(path, dst_dir):
+					skipped_count += 1
+					continue
+				with metrics.stage('copy_submit'):  # Blocks while the queue is full
+					copy_pipeline.submit(path, dst_dir)
+	
+	copy_pipeline.close()
+	if duplicate_finder is not None:
+		duplicate_finder.close()
+		print(f'{duplicate_finder.duplicate_count} duplicates found')
+	metrics.count('unchanged_copies_skipped', skipped_count)
+	if manifest is not None:
+		manifest.close()
+		print(f'{skipped_count} unchanged copies skipped')
+	print(copy_pipeline.get_throughput_str())
+
+
+def classify_sizes(
+		widths: np.ndarray,
+		heights: np.ndarray,
+		targets: List[Tuple[int, int]],
+		error_margin: float
+	) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	Classifies every image against every target in one vectorized pass
+	
+	Same rules as a single target: exact size -:> CORRECT_CODE, smaller in
+	either direction -:> SMALL_CODE, aspect ratio within error margin -:>
+	CORRECT_CODE, otherwise LARGE_CODE
+	
+	:param widths: image widths, shape (images,)
+	:param heights: image heights, shape (images,)
+	:param targets: (width, height) targets
+	:param error_margin: error margin as a percent of the target ratio
+	:return: (codes, relative ratio errors), both shaped (images, targets)
+	"""
+	w = widths.astype(np.float64)[:, None]
+	h = heights.astype(np.float64)[:, None]
+	target_w = np.array([t[0] for t in targets], dtype=np.float64)[None, :]
+	target_h = np.array([t[1] for t in targets], dtype=np.float64)[None, :]
+	target_ratios = target_w / target_h
+	errors = np.abs(w / h - target_ratios) / target_ratios
+	
+	# Later assignments take precedence
+	codes = np.full(errors.shape, LARGE_CODE, dtype=np.int8)
+	codes[errors < error_margin] = CORRECT_CODE
+	codes[(w < target_w) | (h < target_h)] = SMALL_CODE
+	codes[(w == target_w) & (h == target_h)] = CORRECT_CODE
+	return codes, errors
+
+
+def get_target_subdirs(
+		codes: np.ndarray,
+		errors: np.ndarray,
+		targets: List[Tuple[int, int]],
+		match_all: bool = False
+	) -> List[List[str]]:
+	# Destination subdirectories of every image, from classify_sizes output
+	if len(targets) == 1:
+		return [[SUBDIR_NAMES[c]] for c in codes[:, 0]]
+	
+	target_dirs = [
+		os.path.join(CORRECT_DIR_NAME, get_target_dir_name(t))
+		for t in targets
+	]
+	matches = codes == CORRECT_CODE
+	best = np.argmin(np.where(matches, errors, np.inf), axis=1)
+	any_match = matches.any(axis=1)
+	all_small = (codes == SMALL_CODE).all(axis=1)
+	
+	all_target_subdirs = []
+	for row, matched in enumerate(any_match):
+		if matched and match_all:
+			subdirs = [target_dirs[t] for t in np.flatnonzero(matches[row])]
+		elif matched:
+			subdirs = [target_dirs[best[row]]]
+		elif all_small[row]:
+			subdirs = [SMALL_DIR_NAME]
 		else:
-			print(f'"{i}" successfully copied to {target_subdir}')
+			subdirs = [LARGE_DIR_NAME]
+		all_target_subdirs.append(subdirs)
+	return all_target_subdirs
+
+
+def _probe_entry(
+		entry: os.DirEntry,
+		manifest: Optional[ImageManifest],
+		use_exif_orientation: bool
+	) -> Tuple[int, int]:
+	# Manifest size if unchanged, otherwise probed (and recorded)
+	size = None
+	if manifest is not None:
+		stat = entry.stat()
+		size = manifest.get_size(entry.path, stat, use_exif_orientation)
+	if size is None:
+		size = probe_image_size(entry.path, use_exif_orientation)
+		if manifest is not None:
+			manifest.put_size(entry.path, stat, size, use_exif_orientation)
+	w, h = size
+	if w <= 0 or h <= 0:
+		raise ValueError(f'Invalid dimensions {w} x {h}')
+	return w, h
+
+
+def _get_dst_dir(
+		curr_dir: str,
+		output_subdir: str,
+		src: str,
+		created_dirs: Set[str]
+	) -> str:
+	# Source subdirectory of src mirrored under output_subdir, created once
+	rel_dir = os.path.relpath(os.path.dirname(src), curr_dir)
+	dst_dir = os.path.join(curr_dir, output_subdir)
+	if rel_dir == os.curdir:
+		return dst_dir
+	dst_dir = os.path.join(dst_dir, rel_dir)
+	if dst_dir not in created_dirs:
+		try:
+			os.makedirs(dst_dir, exist_ok=True)
+		except OSError as e:  # The copy fails and reports it too
+			print(f'OS Exception when creating {dst_dir}: {type(e)} {e}')
+		created_dirs.add(dst_dir)
+	return dst_dir
+
+
+def _print_copy_result(
+		curr_dir: str,
+		src: str,
+		dst_dir: str,
+		error: Optional[Exception]
+	) -> None:
+	i = os.path.relpath(src, curr_dir)
+	target_subdir = os.path.relpath(dst_dir, curr_dir)
+	if error is not None:
+		print(f'Exception when copying {i}: {type(error)} {error}')
+	else:
+		print(f'"{i}" successfully copied to {target_subdir}')
+
+
+def get_target_dir_name(target: Tuple[int, int]) -> str:
+	return f'{target[0]}x{target[1]}'
+
+
+def parse_target(target_str: str) -> Tuple[int, int]:
+	# '2560x1080' -> (2560, 1080)
+	width, height = target_str.lower().split('x')
+	return int(width), int(height)
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+	items = iter(items)
+	batch = list(islice(items, size))
+	while batch:
+		yield batch
+		batch = list(islice(items, size))
 		
 		
 if __name__ == '__main__':
-	args = sys.argv[1:]
-	group_images_by_aspect_ratio(*args)
+	parser = argparse.ArgumentParser(
+		description='Copy images into subdirectories by aspect ratio'
+	)
+	parser.add_argument('width', type=int, nargs='?', default=1920)
+	parser.add_argument('height', type=int, nargs='?', default=1080)
+	parser.add_argument('error_margin', type=float, nargs='?', default=.01)
+	parser.add_argument(
+		'--transfer',
+		choices=TRANSFER_MODES,
+		default=COPY_MODE,
+		help='how images are copied, falls back to a full copy'
+	)
+	parser.add_argument(
+		'--recursive',
+		action='store_true',
+		help='also sort images in subdirectories, mirrored in the output'
+	)
+	parser.add_argument(
+		'--exclude',
+		action='append',
+		default=[],
+		help='glob pattern of files or subdirectories to skip (repeatable)'
+	)
+	parser.add_argument(
+		'--exif-orientation',
+		action='store_true',
+		help='measure images as displayed, after EXIF rotation'
+	)
+	parser.add_argument(
+		'--target',
+		action='append',
+		type=parse_target,
+		default=[],
+		help='extra WIDTHxHEIGHT target, e.g. 2560x1080 (repeatable)'
+	)
+	parser.add_argument(
+		'--match-all',
+		action='store_true',
+		help='copy to every matching target instead of the best one'
+	)
+	parser.add_argument(
+		'--copy-workers',
+		type=int,
+		default=DEFAULT_COPY_WORKERS,
+		help='copy threads running while images are probed, 0 to disable'
+	)
+	parser.add_argument(
+		'--manifest',
+		nargs='?',
+		const=DEFAULT_MANIFEST_FILE_NAME,
+		help='skip unchanged images and resume interrupted runs with this manifest'
+	)
+	parser.add_argument(
+		'--dedup',
+		choices=DEDUP_MODES,
+		help=f'skip near-duplicate images or copy them to {DUPLICATES_DIR_NAME}'
+	)
+	parser.add_argument(
+		'--dedup-distance',
+		type=int,
+		default=DEFAULT_MAX_DISTANCE,
+		help='differing perceptual hash bits still counted as a duplicate'
+	)
+	add_metrics_arguments(parser)
+	args = parser.parse_args()
+	
+	metrics = RunMetrics(METRICS_NAME)
+	with profile_run(metrics, args.profile, args.trace_memory):
+		group_images_by_aspect_ratio(
+			args.width,
+			args.height,
+			args.error_margin,
+			args.transfer,
+			args.recursive,
+			args.exclude,
+			args.exif_orientation,
+			args.target,
+			args.match_all,
+			args.copy_workers,
+			args.manifest,
+			args.dedup,
+			args.dedup_distance,
+			metrics,
+			args.verbose
+		)
+	write_metrics(metrics, args)
@@ -1,10 +1,53 @@
+import argparse
 import os
+import queue
+import threading
 
-from PIL import Image, ImageTk, ImageFile
-from shutil import copy2
+from array import array
+from bucket_rules import (
+    auto_bucket_images,
+    DEFAULT_RULE_WORKERS,
+    read_rules,
+    Rule,
+)
+from collections import deque
+from copy_pipeline import CopyPipeline, DEFAULT_COPY_WORKERS
+from file_catalog import CatalogPaths, FileCatalog
+from file_scanner import scan_files
+from file_transfer import (
+    COPY_MODE,
+    FileTransfer,
+    is_complete_copy,
+    TRANSFER_MODES,
+)
+from image_dedup import (
+    DEDUP_BUCKET,
+    DEDUP_MODES,
+    DEFAULT_HASH_CACHE_FILE_NAME,
+    DEFAULT_MAX_DISTANCE,
+    DuplicateFinder,
+    DUPLICATES_DIR_NAME,
+)
+from image_prefetcher import (
+    DEFAULT_CACHE_BYTES,
+    DEFAULT_PREFETCH_AHEAD,
+    DEFAULT_PREFETCH_BEHIND,
+    ImagePrefetcher,
+)
+from PIL import ImageTk, ImageFile
+from session_journal import (
+    DEFAULT_JOURNAL_FILE_NAME,
+    read_journal,
+    SessionJournal,
+)
 from string import ascii_letters, digits
+from thumbnail_cache import (
+    DEFAULT_MAX_CACHE_BYTES,
+    DEFAULT_THUMBNAIL_DIR,
+    ThumbnailCache,
+)
 from tkinter import messagebox, StringVar, ttk, Tk
-from typing import Dict, List
+from typing import Container, Deque, Dict, List, Optional, Tuple
 
 # Bucket defaults
 DEFAULT_AMOUNT = 3
@@ -25,16 +68,44 @@ CONFIRM_COPY_BUTTON_STR = "Confirm File Copy"
 # Error Strings
 HEADER_ERR = 'Error'
 FILES_NOT_FOUND_ERR = 'No image files in target directory: '
+RULES_NEED_CONFIG_ERR = 'Rules need the bucket names from '
+PREPARE_FAILED_ERR = 'Duplicate detection or rule matching failed: '
 
 # Results Strings
 FILES_COPIED_STR = ' files copied!'
 ERRS_CAPTURED_STR = ' errors captured!'
+IMAGES_PER_BUCKET_STR = 'Images per bucket: '
+RESULTS_LOG_LINES = 30  # Only the latest log lines are kept
+
+# Background copy strings
+COPY_STATUS_STR = 'Copies done / queued / failed: '
+FINISHING_COPIES_STR = 'Finishing remaining copies... '
+COPY_POLL_MS = 200
+
+# Journal strings
+UNKNOWN_JOURNAL_BUCKET_ERR = ' journaled images use unknown buckets, shown again: '
+JOURNAL_ROTATED_STR = 'Previous journal kept as '
+
+# Duplicate detection and rule matching strings
+DEDUP_PROGRESS_STR = 'Images checked for duplicates: '
+RULES_PROGRESS_STR = 'Images matched against rules: '
+PREPARE_POLL_MS = 100
+
+# Fast sort and undo
+UNDO_KEYS = ['<BackSpace>', 'u']
+UNDO_STR = "Backspace: undo"
+NOTHING_TO_UNDO_STR = 'Nothing to undo'
+DEFAULT_UNDO_DEPTH = 10
+STATUS_PANEL_LINES = 5
 
 # Filters
 VALID_NAME_CHARS = list(digits) + list(ascii_letters) + ['_']
 IMG_MAX_HEIGHT = 900
 IMG_MAX_WIDTH = 1850
 
+# Image screen layout
+VIEWER_GRID = {'column': 1, 'padx': 50, 'pady': 10}
+
 
 class ImageBucketSorter:
     """
@@ -46,9 +117,61 @@ class ImageBucketSorter:
     NOTE: Only tested thoroughly on VALID_IMAGE_EXTENSIONS
     NOTE: Pillow ImageTk library docs: "Currently, the PhotoImage widget
           supports the GIF, PGM, PPM, and PNG file as of latest Tkinter version"
+    NOTE: The next prefetch_ahead and previous prefetch_behind images are
+          decoded and scaled in the background into a cache_bytes LRU cache
+    NOTE: Images are copied on copy_workers background threads as soon as
+          they are assigned to a bucket
+    NOTE: Decisions can be undone (UNDO_KEYS) until undo_depth newer ones are
+          made, their copies are only queued after that
+    NOTE: fast_mode skips the confirmation dialog and shows errors in a
+          status panel instead of modal dialogs
+    NOTE: Every decision is journaled to DEFAULT_JOURNAL_FILE_NAME, with
+          resume=True images already sorted by a previous session are skipped
+    NOTE: JPEGs are decoded at reduced size, with thumbnail_dir downscaled
+          images are kept there between runs, up to thumbnail_cache_bytes
+    NOTE: With rules_path, images a rule matches are sorted without being
+          shown (see bucket_rules.read_rules), requires CONFIG_FILE_NAME
+    NOTE: With dedup_mode, near-duplicates of an earlier image are never
+          shown, DEDUP_BUCKET copies them to DUPLICATES_DIR_NAME
+    NOTE: Duplicate detection and rule matching run on a thread behind a
+          progress screen, the setup or image screen follows
     """
-    def __init__(self) -> None:
-        self._log = []
+    def __init__(
+            self,
+            transfer_mode: str = COPY_MODE,
+            prefetch_ahead: int = DEFAULT_PREFETCH_AHEAD,
+            prefetch_behind: int = DEFAULT_PREFETCH_BEHIND,
+            cache_bytes: int = DEFAULT_CACHE_BYTES,
+            thumbnail_dir: Optional[str] = None,
+            thumbnail_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+            copy_workers: int = DEFAULT_COPY_WORKERS,
+            resume: bool = False,
+            fast_mode: bool = False,
+            undo_depth: int = DEFAULT_UNDO_DEPTH,
+            rules_path: Optional[str] = None,
+            rule_workers: int = DEFAULT_RULE_WORKERS,
+            dedup_mode: Optional[str] = None,
+            dedup_distance: int = DEFAULT_MAX_DISTANCE,
+        ) -> None:
+        self.file_transfer = FileTransfer(transfer_mode)
+        
+        # Worker threads only queue (src, dst_dir, error), the Tk thread logs
+        self._copy_results = queue.SimpleQueue()
+        self.copy_pipeline = CopyPipeline(
+            self.file_transfer,
+            copy_workers,
+            lambda src, dst_dir, e: self._copy_results.put((src, dst_dir, e)),
+        )
+        self._finishing = False  # Waiting for the last copies
+        self.journal = None  # SessionJournal
+        
+        # (image index, image, bucket) decisions whose copy is not queued yet
+        self.fast_mode = fast_mode
+        self.undo_depth = undo_depth
+        self._undo_stack: Deque[Tuple[int, str, str]] = deque()
+        self._status_lines: Deque[str] = deque(maxlen=STATUS_PANEL_LINES)
+        self.prefetcher = None  # ImagePrefetcher
+        self._log: Deque[str] = deque(maxlen=RESULTS_LOG_LINES)
         self._log_error_count = 0
         self._log_file_count = 0
         
@@ -62,10 +185,27 @@ class ImageBucketSorter:
         # Class vars for callbacks and image viewer
         self.amount_entry = None  # Entry
         self.name_entry = None  # StringVar
-        self.pil_image = None  # PIL.Image
         self.scaled_image = None  # PIL.Image
         self.tk_image = None  # ImageTk.PhotoImage
+        self._tk_image_key = None  # (size, mode) tk_image was created with
         self.lbl_image = None  # ttk.Label
+        self.lbl_info = None  # ttk.Label
+        self.keymap_str = ''
+        self.curr_image_name = None
+        self.lbl_copy_status = None  # ttk.Label
+        self.lbl_status_panel = None  # ttk.Label, fast_mode errors
+        self.lbl_prepare_status = None  # ttk.Label
+        
+        # Duplicate detection and rule matching thread, its results are
+        # applied on the Tk thread
+        self.dedup_mode = dedup_mode
+        self._prepare_thread = None  # threading.Thread
+        self._prepare_stage_str = ''
+        self._prepare_done_count = 0
+        self._prepare_total_count = 0
+        self._duplicates: Dict[str, str] = {}
+        self._rules_decisions: Dict[str, str] = {}
+        self._prepare_error = None  # Exception
         
         # Init full-screen Tkinter UI
         self.tk = Tk()
@@ -78,66 +218,82 @@ class ImageBucketSorter:
         self.root = ttk.Frame(self.tk)
         self.root.grid(column=0, row=0)
         
-        # Prep file names
+        # Prep file names. Scanned images live in a compact catalog, which
+        # also holds the bucket bitmaps, image_file_names is a view of the
+        # images still to be shown
         self.curr_dir = os.getcwd()
-        all_file_names = [
-            f for f in os.listdir(self.curr_dir)
-            if os.path.isfile(os.path.join(self.curr_dir, f))
-        ]
-        self.image_file_names = [
-            f for f in all_file_names
-            if str(os.path.splitext(f)[1]).lower() in VALID_IMAGE_EXTENSIONS
-        ]
+        self.catalog = FileCatalog()
+        for entry in scan_files(self.curr_dir, VALID_IMAGE_EXTENSIONS):
+            self.catalog.add_entry(entry, relative=True)
+        self._view_indexes = array('I', range(len(self.catalog)))
+        self.image_file_names = CatalogPaths(self.catalog, self._view_indexes)
         if not self.image_file_names:
             err_msg = FILES_NOT_FOUND_ERR + f'{self.curr_dir}'
             messagebox.showerror(HEADER_ERR, err_msg)
             self.tk.destroy()  # End app
             return
         
-        self._total_image_count = len(self.image_file_names)
+        # Config bucket names, rules may only assign to these
+        rules = None
+        try:
+            bucket_names = read_bucket_config(
+                os.path.join(self.curr_dir, CONFIG_FILE_NAME)
+            )
+            if rules_path is not None:
+                if bucket_names is None:
+                    raise ValueError(RULES_NEED_CONFIG_ERR + CONFIG_FILE_NAME)
+                rules = read_rules(rules_path, bucket_names)
+        except (OSError, ValueError) as e:
+            messagebox.showerror(HEADER_ERR, str(e))
+            self.tk.destroy()  # End app
+            return
+        
+        # Images sorted by a previous session are replayed, not shown again
+        journal_path = os.path.join(self.curr_dir, DEFAULT_JOURNAL_FILE_NAME)
+        self._resumed_decisions = read_journal(journal_path) if resume else {}
+        self.drop_from_view(self._resumed_decisions)
+        self.journal = SessionJournal(journal_path, resume)
+        if self.journal.rotated_path is not None:
+            self.log(JOURNAL_ROTATED_STR + self.journal.rotated_path)
+        
+        # Prefetching starts once the images left to show are known
+        thumbnail_cache = None
+        if thumbnail_dir is not None:
+            thumbnail_cache = ThumbnailCache(
+                thumbnail_dir,
+                IMG_MAX_WIDTH,
+                IMG_MAX_HEIGHT,
+                thumbnail_cache_bytes,
+            )
+        self._prefetch_settings = (
+            prefetch_ahead,
+            prefetch_behind,
+            cache_bytes,
+            thumbnail_cache,
+        )
+        self.tk.after(COPY_POLL_MS, self.poll_copy_results)
         
         # Use defaults from config file if possible
-        if CONFIG_FILE_NAME in all_file_names:
-            with open(CONFIG_FILE_NAME, 'r') as f:
-                bucket_names = [
-                    l.strip() for l in f.readlines() if len(l.strip()) > 0
-                ]
-            amount = len(bucket_names)
-            incorrect_amount = amount < 2 or amount > 9
-            contains_duplicates = amount != len(set(bucket_names))
-            invalid_names = not self.bucket_names_are_valid(bucket_names)
-            
-            if incorrect_amount or contains_duplicates or invalid_names:
-                err_str = f'{AMOUNT_INSTR_STR} {NAMING_INSTR_STR}'
-                err_str += f' in "{CONFIG_FILE_NAME}"'
-                messagebox.showerror(HEADER_ERR, err_str)
-                self.tk.destroy()  # End app
-                return
-            
-            self.amount = amount
-            self.buckets = {b: set() for b in bucket_names}
+        if bucket_names is not None:
+            self.amount = len(bucket_names)
+            self.buckets = list(bucket_names)
             self.key_mapping = {
                 str(i + 1): b for i, b in enumerate(bucket_names)
             }
-            
-            # Skip amount and naming screens
-            self.create_image_screen()
         
         else:  # Use hardcoded defaults
             self.amount = DEFAULT_AMOUNT
-            self.buckets = {
-                f"bucket_{i + 1}": set() for i in range(self.amount)
-            }
+            self.buckets = [f"bucket_{i + 1}" for i in range(self.amount)]
             self.key_mapping = {
                 str(i + 1): f"bucket_{i + 1}" for i in range(self.amount)
             }
-            
-            # DEBUG: skip directly to screen
-            self.create_amount_screen()
-            # self.create_name_screen()
-            # self.create_image_screen()
-            # self.bucket_sort_images()  # DEBUG: requires additional input
-            # self.create_results_screen()  # DEBUG: requires additional input
+        self._has_bucket_config = bucket_names is not None
+        
+        # Duplicates and rules are worked out behind a progress screen
+        if dedup_mode is not None or rules is not None:
+            self.create_prepare_screen(rules, rule_workers, dedup_distance)
+        else:
+            self.start_sorting()
     
     ############################################################################
     # CREATE SCREEN FUNCTIONS
@@ -191,44 +347,118 @@ class ImageBucketSorter:
         name_button.grid(**self._gridv())
     
     def create_image_screen(self) -> None:
-        if self._curr_image_count < self._total_image_count:
+        # Shows the next image. The viewer widgets and key bindings are built
+        # once, later images only update the label text and the PhotoImage
+        if self._resumed_decisions:
+            self.replay_journal()
+        
+        loaded = None
+        while loaded is None:
+            if self._curr_image_count >= self._total_image_count:
+                self.create_finishing_screen()
+                return
+            
             image_name = self.image_file_names[self._curr_image_count]
             self._curr_image_count += 1
-        else:
-            self.clear_screen()
-            self.bucket_sort_images()
-            self.create_results_screen()
-            return
+            
+            # Usually already decoded and scaled by the prefetcher
+            try:
+                loaded = self.prefetcher.get(self._curr_image_count - 1)
+            except Exception as e:
+                self.log(f"Unhandled Exception when opening {image_name}: {type(e)} {e}", True)
         
-        # Image
-        self.pil_image = Image.open(image_name)
-        width, height = self.pil_image.size
+        (width, height), self.scaled_image = loaded
+        self.curr_image_name = image_name
+        if self.lbl_image is None:
+            self.create_viewer()
         
         # Labels
         progress_str = f"[{self._curr_image_count} / {self._total_image_count}]"
         image_info_str = f"Current Image: {image_name} ({width} x {height})"
-        keymap_str = '        '.join([
+        self.lbl_info.configure(
+            text=progress_str + image_info_str + self.keymap_str
+        )
+        
+        # Same size and mode images are pasted into the existing PhotoImage,
+        # paste() converts to the PhotoImage's mode (L would turn RGB grey)
+        tk_image = self.tk_image
+        if tk_image is not None and self._tk_image_key == (
+            self.scaled_image.size, self.scaled_image.mode
+        ):
+            tk_image.paste(self.scaled_image)
+        else:
+            self.tk_image = ImageTk.PhotoImage(self.scaled_image)
+            self._tk_image_key = (self.scaled_image.size, self.scaled_image.mode)
+            self.lbl_image.configure(image=self.tk_image)
+        self.lbl_image.focus_set()
+    
+    def create_viewer(self) -> None:
+        # Long-lived image screen widgets, rows are fixed instead of _gridv()
+        self.keymap_str = '        '.join([
             f"{key}: '{b}'" for key, b in self.key_mapping.items()
-        ])
-        ttk.Label(
+        ] + [UNDO_STR])
+        self.lbl_info = ttk.Label(self.root)
+        self.lbl_info.grid(row=1, **VIEWER_GRID)
+        self.lbl_image = ttk.Label(self.root)
+        self.lbl_image.grid(row=2, **VIEWER_GRID)
+        self.lbl_copy_status = ttk.Label(self.root, text=self.get_copy_status_str())
+        self.lbl_copy_status.grid(row=3, **VIEWER_GRID)
+        self.lbl_status_panel = ttk.Label(
             self.root,
-            text=progress_str + image_info_str + keymap_str
-        ).grid(**self._gridv())
-        
-        self.scaled_image = self.get_scaled_image(self.pil_image)
-        self.tk_image = ImageTk.PhotoImage(self.scaled_image)
-        self.lbl_image = ttk.Label(self.root, image=self.tk_image)
+            text='\n'.join(self._status_lines),
+        )
+        self.lbl_status_panel.grid(row=4, **VIEWER_GRID)
         
-        # Dynamic binds
+        # Bound once, the current image is read when the key is pressed
         for key, bucket_name in self.key_mapping.items():  # {'1': 'name_1'}
-            data = {'bucket': bucket_name, 'image': image_name}
             self.lbl_image.bind(
                 key,
-                lambda e, d=data: self.on_keyclick_add_to_bucket(e, d)
+                lambda e, b=bucket_name: self.on_keyclick_add_to_bucket(
+                    e, {'bucket': b, 'image': self.curr_image_name}
+                )
             )
-        
-        self.lbl_image.grid(**self._gridv())
-        self.lbl_image.focus_set()
+        for key in UNDO_KEYS:
+            self.lbl_image.bind(key, self.on_keyclick_undo)
+    
+    def create_prepare_screen(
+            self,
+            rules: Optional[List[Rule]],
+            rule_workers: int,
+            dedup_distance: int
+        ) -> None:
+        # Shown while duplicates are found and images matched on a thread,
+        # poll_prepare moves on to the setup or image screen
+        if self.dedup_mode is not None:
+            self.set_prepare_stage(DEDUP_PROGRESS_STR, len(self.catalog))
+        else:
+            self.set_prepare_stage(RULES_PROGRESS_STR, len(self.image_file_names))
+        ttk.Label(self.root, text=TITLE_STR).grid(**self._gridv())
+        self.lbl_prepare_status = ttk.Label(
+            self.root, text=self.get_prepare_status_str()
+        )
+        self.lbl_prepare_status.grid(**self._gridv())
+        self._prepare_thread = threading.Thread(
+            target=self.prepare_images,
+            args=(self.image_file_names, rules, rule_workers, dedup_distance),
+            daemon=True,  # Closing the window does not wait for it
+        )
+        self._prepare_thread.start()
+        self.tk.after(PREPARE_POLL_MS, self.poll_prepare)
+    
+    def create_finishing_screen(self) -> None:
+        # Shown while the tail of the copy queue drains, poll_copy_results
+        # moves on to the results screen
+        self.prefetcher.close()
+        self.journal.close()
+        while self._undo_stack:  # No more undos, queue the held back copies
+            _, image, bucket = self._undo_stack.popleft()
+            self.queue_copy(image, bucket)
+        self.clear_screen()
+        self._finishing = True
+        ttk.Label(self.root, text=TITLE_STR).grid(**self._gridv())
+        ttk.Label(self.root, text=FINISHING_COPIES_STR).grid(**self._gridv())
+        self.lbl_copy_status = ttk.Label(self.root, text=self.get_copy_status_str())
+        self.lbl_copy_status.grid(**self._gridv())
     
     def create_results_screen(self) -> None:
         fc_str = f'{self._log_file_count}{FILES_COPIED_STR}'
@@ -236,7 +466,10 @@ class ImageBucketSorter:
         ttk.Label(self.root, text=TITLE_STR).grid(**self._gridv())
         ttk.Label(self.root, text=fc_str).grid(**self._gridv())
         ttk.Label(self.root, text=ec_str).grid(**self._gridv())
-        ttk.Label(self.root, text="\n".join(self._log[:30])).grid(
+        ttk.Label(self.root, text=self.get_bucket_counts_str()).grid(
+            **self._gridv()
+        )
+        ttk.Label(self.root, text="\n".join(self._log)).grid(
             **self._gridv()
         )
     
@@ -263,7 +496,7 @@ class ImageBucketSorter:
             self.create_image_screen()
         
         elif self.bucket_names_are_valid(bucket_names):
-            self.buckets = {b: set() for b in bucket_names}
+            self.buckets = list(bucket_names)
             self.key_mapping = {
                 str(i + 1): b for i, b in enumerate(bucket_names)
             }
@@ -271,91 +504,508 @@ class ImageBucketSorter:
             self.create_image_screen()
     
     def on_keyclick_add_to_bucket(self, _, data: Dict[str, str]) -> None:
-        answer = messagebox.askokcancel(
+        answer = self.fast_mode or messagebox.askokcancel(
             CONFIRM_COPY_BUTTON_STR,
             f"File '{data['image']}'' will be copied to '{data['bucket']}'",
         )
         if answer:
-            self.buckets[data['bucket']].add(data['image'])
-            self.clear_screen()
+            self.add_to_bucket(data['image'], data['bucket'])
             self.create_image_screen()
     
+    def on_keyclick_undo(self, _) -> None:
+        # Reverts the last decision and shows its image again
+        if not self._undo_stack:
+            self.show_status(NOTHING_TO_UNDO_STR)
+            return
+        index, image, bucket = self._undo_stack.pop()
+        self.catalog.remove_from_bucket(self._view_indexes[index], bucket)
+        self.journal.record(image, None)
+        self._curr_image_count = index
+        self.create_image_screen()
+    
     ############################################################################
     # OTHER FUNCS
     ############################################################################
     def bucket_names_are_valid(self, bucket_names: List[str]) -> bool:
-        # Check for copies
-        if len(bucket_names) != len(set(bucket_names)):
-            return False
-        
-        # Check for mismatch
-        for name in bucket_names:
-            for ch in name:
-                if ch not in self.VALID_NAME_CHARS:
-                    return False
-        return True
+        return bucket_names_are_valid(bucket_names)
+    
+    def drop_from_view(self, images: Container[str]) -> None:
+        # Images that will not be shown, the catalog keeps their records
+        self._view_indexes = array('I', (
+            i for i in self._view_indexes
+            if self.catalog.get_name(i) not in images
+        ))
+        self.image_file_names = CatalogPaths(self.catalog, self._view_indexes)
     
     def clear_screen(self) -> None:
         for w in self.root.winfo_children():
             w.destroy()
+        self.lbl_info = None
+        self.lbl_image = None
+        self.tk_image = None
+        self.lbl_copy_status = None
+        self.lbl_status_panel = None
+        self.lbl_prepare_status = None
     
-    def bucket_sort_images(self) -> None:
-        # Creates subdirectories based on bucket names and sorts images by
-        # COPYING images from curr_dir to each subdirectory
-        all_subdir_names = [
-            f for f in os.listdir(self.curr_dir)
-            if os.path.isdir(os.path.join(self.curr_dir, f))
-        ]
-        
-        # Create subdirectories only if they do not exist
-        for bucket, image_set in self.buckets.items():
-            if bucket not in all_subdir_names:
-                try:
-                    os.mkdir(os.path.join(self.curr_dir, bucket))
-                    self.log(f"Successfully created {bucket}")
-                except FileExistsError as e:
-                    self.log(f"{bucket} already exists in {self.curr_dir}: {type(e)} {e}", True)
-                except FileNotFoundError as e:
-                    self.log(f"{self.curr_dir} not found: {type(e)} {e}", True)
-                except OSError as e:
-                    self.log(f"OS or I/O Exception when creating {bucket}: {type(e)} {e}", True)
-                except Exception as e:
-                    self.log(f"Unhandled Exception when creating dir {bucket}: {type(e)} {e}", True)
-            
-            # Subdir guaranteed to exist by now
-            for image in image_set:
+    def start_sorting(self) -> None:
+        # Decoding starts while the setup screens are shown, a bucket config
+        # skips the amount and naming screens
+        self.start_prefetcher()
+        if self._has_bucket_config:
+            self.create_image_screen()
+        else:
+            # DEBUG: skip directly to screen
+            self.create_amount_screen()
+            # self.create_name_screen()
+            # self.create_image_screen()
+            # self.create_finishing_screen()  # DEBUG: requires additional input
+            # self.create_results_screen()  # DEBUG: requires additional input
+    
+    def start_prefetcher(self) -> None:
+        # Starts decoding the images left to show
+        ahead, behind, cache_bytes, thumbnail_cache = self._prefetch_settings
+        self._total_image_count = len(self.image_file_names)
+        self.prefetcher = ImagePrefetcher(
+            self.image_file_names,
+            IMG_MAX_WIDTH,
+            IMG_MAX_HEIGHT,
+            ahead,
+            behind,
+            cache_bytes,
+            thumbnail_cache=thumbnail_cache,
+        )
+        self.prefetcher.prefetch_around(-1)
+    
+    def prepare_images(
+            self,
+            image_names: CatalogPaths,
+            rules: Optional[List[Rule]],
+            rule_workers: int,
+            dedup_distance: int
+        ) -> None:
+        # Runs on the prepare thread, must not touch Tk widgets or the journal.
+        # Duplicates are found before rules see the images, images sorted by
+        # a previous session are hashed too
+        try:
+            if self.dedup_mode is not None:
+                # Created here, its SQLite cache only works on one thread
+                duplicate_finder = DuplicateFinder(
+                    dedup_distance,
+                    cache_path=os.path.join(
+                        self.curr_dir, DEFAULT_HASH_CACHE_FILE_NAME
+                    ),
+                )
                 try:
-                    copy2(
-                        os.path.join(self.curr_dir, image),
-                        os.path.join(self.curr_dir, bucket),
+                    self._duplicates = duplicate_finder.find_all(
+                        self.catalog, self.set_prepare_progress
                     )
-                    self.log(f"Successfully copied {image} to {bucket}")
-                    self._log_file_count += 1
-                except Exception as e:
-                    self.log(f"Unhandled Exception when copying {image} to {bucket}: {type(e)} {e}", True)
-    
-    def get_scaled_image(self, image: Image) -> Image:
-        # Only need to use the largest scaling ratio to guarantee it is within bounds
-        width, height = image.size
-        scaling_ratio = max([width / self.IMG_MAX_WIDTH, height / self.IMG_MAX_HEIGHT])
-        if scaling_ratio > 1:
-            new_width = int(width * (1 / scaling_ratio))
-            new_height = int(height * (1 / scaling_ratio))
-            image = image.resize((new_width, new_height))
-        return image
+                finally:
+                    duplicate_finder.close()
+            
+            if rules is not None:
+                duplicates = self._duplicates
+                self.set_prepare_stage(
+                    RULES_PROGRESS_STR, len(image_names) - len(duplicates)
+                )
+                self._rules_decisions = auto_bucket_images(
+                    self.curr_dir,
+                    (name for name in image_names if name not in duplicates),
+                    rules,
+                    rule_workers,
+                    self.set_prepare_progress,
+                )
+        except Exception as e:
+            self._prepare_error = e
+    
+    def set_prepare_stage(self, stage_str: str, total_count: int) -> None:
+        self._prepare_stage_str = stage_str
+        self._prepare_total_count = total_count
+        self._prepare_done_count = 0
+    
+    def set_prepare_progress(self, done_count: int) -> None:
+        self._prepare_done_count = done_count
+    
+    def poll_prepare(self) -> None:
+        # Runs on the Tk thread every PREPARE_POLL_MS until the prepare thread
+        # is done. Duplicates are dropped (or copied to DUPLICATES_DIR_NAME),
+        # images a rule matched are journaled and replayed like resumed ones
+        if self._prepare_thread.is_alive():
+            self.lbl_prepare_status.configure(text=self.get_prepare_status_str())
+            self.tk.after(PREPARE_POLL_MS, self.poll_prepare)
+            return
+        
+        if self._prepare_error is not None:
+            e = self._prepare_error
+            self.log(f'{PREPARE_FAILED_ERR}{type(e)} {e}', True)
+        
+        duplicates, self._duplicates = self._duplicates, {}
+        self.drop_from_view(duplicates)
+        if self.dedup_mode == DEDUP_BUCKET:
+            for image in duplicates:
+                if image in self._resumed_decisions:
+                    continue
+                if not self.is_copied(image, DUPLICATES_DIR_NAME):
+                    self.queue_copy(image, DUPLICATES_DIR_NAME)
+        
+        decisions, self._rules_decisions = self._rules_decisions, {}
+        for image, bucket in decisions.items():
+            self.journal.record(image, bucket)
+        self._resumed_decisions.update(decisions)
+        self.drop_from_view(decisions)
+        self.clear_screen()
+        self.start_sorting()
+    
+    def add_to_bucket(self, image: str, bucket: str) -> None:
+        # Journals the decision and holds it on the undo stack, the oldest
+        # decision beyond undo_depth has its copy queued
+        self.journal.record(image, bucket)
+        index = self._view_indexes[self._curr_image_count - 1]
+        self.catalog.add_to_bucket(index, bucket)
+        self._undo_stack.append((self._curr_image_count - 1, image, bucket))
+        if len(self._undo_stack) > self.undo_depth:
+            _, old_image, old_bucket = self._undo_stack.popleft()
+            self.queue_copy(old_image, old_bucket)
+    
+    def queue_copy(self, image: str, bucket: str) -> None:
+        # Creates the bucket subdirectory on first use and queues a COPY of
+        # the image from curr_dir into it
+        bucket_dir = os.path.join(self.curr_dir, bucket)
+        if not os.path.isdir(bucket_dir):
+            try:
+                os.mkdir(bucket_dir)
+                self.log(f"Successfully created {bucket}")
+            except FileExistsError as e:
+                self.log(f"{bucket} already exists in {self.curr_dir}: {type(e)} {e}", True)
+            except FileNotFoundError as e:
+                self.log(f"{self.curr_dir} not found: {type(e)} {e}", True)
+            except OSError as e:
+                self.log(f"OS or I/O Exception when creating {bucket}: {type(e)} {e}", True)
+            except Exception as e:
+                self.log(f"Unhandled Exception when creating dir {bucket}: {type(e)} {e}", True)
+        
+        self.copy_pipeline.submit(os.path.join(self.curr_dir, image), bucket_dir)
+    
+    def replay_journal(self) -> None:
+        # Restores the resumed session's decisions once the buckets are known.
+        # Copies missing from the bucket subdirectories, or cut short by a
+        # crash, are queued again
+        decisions, self._resumed_decisions = self._resumed_decisions, {}
+        indexes = {}  # Catalog index of every replayed image still scanned
+        for i in range(len(self.catalog)):
+            image = self.catalog.get_name(i)
+            if image in decisions:
+                indexes[image] = i
+        
+        unknown = []
+        for image, bucket in decisions.items():
+            if bucket not in self.buckets:
+                unknown.append(image)
+                continue
+            if image in indexes:
+                self.catalog.add_to_bucket(indexes[image], bucket)
+            if not self.is_copied(image, bucket):
+                self.queue_copy(image, bucket)
+        
+        if unknown:  # Bucket names changed since, sort these again
+            self._view_indexes.extend(
+                indexes[image] for image in unknown if image in indexes
+            )
+            self._total_image_count = len(self.image_file_names)
+            self.log(
+                f"{len(unknown)}{UNKNOWN_JOURNAL_BUCKET_ERR}{', '.join(unknown[:5])}",
+                True,
+            )
+    
+    def is_copied(self, image: str, bucket: str) -> bool:
+        return is_complete_copy(
+            os.path.join(self.curr_dir, image),
+            os.path.join(self.curr_dir, bucket, image),
+        )
+    
+    def poll_copy_results(self) -> None:
+        # Runs on the Tk thread every COPY_POLL_MS
+        if not self._finishing:
+            self.journal.sync_if_due()
+        self._log_copy_results()
+        if self.lbl_copy_status is not None:
+            self.lbl_copy_status.configure(text=self.get_copy_status_str())
+        
+        if self._finishing and self.copy_pipeline.get_pending_count() == 0:
+            self.copy_pipeline.close()
+            self._log_copy_results()
+            self.clear_screen()
+            self.create_results_screen()
+            return
+        self.tk.after(COPY_POLL_MS, self.poll_copy_results)
+    
+    def get_copy_status_str(self) -> str:
+        pipeline = self.copy_pipeline
+        return (
+            f'{COPY_STATUS_STR}{pipeline.copied_count} / '
+            f'{pipeline.get_pending_count()} / {pipeline.error_count}'
+        )
+    
+    def get_bucket_counts_str(self) -> str:
+        # Images per bucket, this session and replayed ones, undos excluded
+        return IMAGES_PER_BUCKET_STR + ', '.join(
+            f'{bucket} {self.catalog.count_bucket(bucket)}'
+            for bucket in self.buckets
+        )
+    
+    def get_prepare_status_str(self) -> str:
+        return (
+            f'{self._prepare_stage_str}{self._prepare_done_count} / '
+            f'{self._prepare_total_count}'
+        )
     
     def log(self, data: str, is_error: bool = False) -> None:
         if is_error:
             self._log_error_count += 1
-            messagebox.showerror("Error", data)
+            if self.fast_mode:
+                self.show_status(data)
+            else:
+                messagebox.showerror("Error", data)
         self._log.append(data)
     
+    def show_status(self, data: str) -> None:
+        # Non-modal, keeps the last STATUS_PANEL_LINES messages
+        self._status_lines.append(data)
+        if self.lbl_status_panel is not None:
+            self.lbl_status_panel.configure(text='\n'.join(self._status_lines))
+    
+    def _log_copy_results(self) -> None:
+        while True:
+            try:
+                src, dst_dir, e = self._copy_results.get_nowait()
+            except queue.Empty:
+                return
+            image = os.path.basename(src)
+            bucket = os.path.basename(dst_dir)
+            if e is None:
+                self.log(f"Successfully copied {image} to {bucket}")
+                self._log_file_count += 1
+            else:
+                self.log(f"Unhandled Exception when copying {image} to {bucket}: {type(e)} {e}", True)
+    
     def _gridv(self) -> Dict[str, int]:
         # Appends widgets vertically
         r = len(self.root.winfo_children()) + 1
         return {'column': 1, 'row': r, 'padx': 50, 'pady': 10}
 
 
+def bucket_names_are_valid(bucket_names: List[str]) -> bool:
+    # Check for copies
+    if len(bucket_names) != len(set(bucket_names)):
+        return False
+    
+    # Check for mismatch
+    for name in bucket_names:
+        for ch in name:
+            if ch not in VALID_NAME_CHARS:
+                return False
+    return True
+
+
+def read_bucket_config(config_path: str) -> Optional[List[str]]:
+    """
+    Reads bucket names, one per line
+
+    :param config_path: CONFIG_FILE_NAME path
+    :return: bucket names, None if there is no config file
+    :raises ValueError: on a wrong amount or invalid names
+    """
+    if not os.path.isfile(config_path):
+        return None
+    with open(config_path, 'r') as f:
+        bucket_names = [l.strip() for l in f.readlines() if len(l.strip()) > 0]
+    amount = len(bucket_names)
+    if amount < 2 or amount > 9 or not bucket_names_are_valid(bucket_names):
+        err_str = f'{AMOUNT_INSTR_STR} {NAMING_INSTR_STR}'
+        raise ValueError(err_str + f' in "{CONFIG_FILE_NAME}"')
+    return bucket_names
+
+
+def auto_sort_images(
+        rules_path: str,
+        transfer_mode: str = COPY_MODE,
+        copy_workers: int = DEFAULT_COPY_WORKERS,
+        rule_workers: int = DEFAULT_RULE_WORKERS
+    ) -> int:
+    """
+    Headless: copies every image of the current directory a rule matches into
+    its bucket and journals it, so a later resume=True session only shows
+    the images left
+
+    :return: amount of images left for manual sorting
+    """
+    curr_dir = os.getcwd()
+    bucket_names = read_bucket_config(os.path.join(curr_dir, CONFIG_FILE_NAME))
+    if bucket_names is None:
+        raise ValueError(RULES_NEED_CONFIG_ERR + CONFIG_FILE_NAME)
+    rules = read_rules(rules_path, bucket_names)
+    
+    journal_path = os.path.join(curr_dir, DEFAULT_JOURNAL_FILE_NAME)
+    sorted_images = read_journal(journal_path)
+    image_file_names = [
+        entry.name
+        for entry in scan_files(curr_dir, VALID_IMAGE_EXTENSIONS)
+        if entry.name not in sorted_images
+    ]
+    decisions = auto_bucket_images(
+        curr_dir,
+        image_file_names,
+        rules,
+        rule_workers,
+    )
+    
+    def on_copied(src: str, dst_dir: str, e: Optional[Exception]) -> None:
+        if e is not None:
+            print(f'Error copying {src} to {dst_dir}: {type(e)} {e}')
+    
+    journal = SessionJournal(journal_path, resume=True)
+    pipeline = CopyPipeline(FileTransfer(transfer_mode), copy_workers, on_copied)
+    try:
+        for bucket in set(decisions.values()):
+            os.makedirs(os.path.join(curr_dir, bucket), exist_ok=True)
+        for image, bucket in decisions.items():
+            journal.record(image, bucket)
+            pipeline.submit(
+                os.path.join(curr_dir, image),
+                os.path.join(curr_dir, bucket),
+            )
+    finally:
+        pipeline.close()
+        journal.close()
+    
+    for bucket in bucket_names:
+        count = sum(1 for b in decisions.values() if b == bucket)
+        print(f'{bucket}: {count}')
+    left_count = len(image_file_names) - len(decisions)
+    print(
+        f'{len(decisions)} images sorted by rules ({pipeline.error_count} '
+        f'copy errors), {left_count} left, sort them with --resume'
+    )
+    return left_count
+
+
 if __name__ == "__main__":
-    sorter = ImageBucketSorter()
+    parser = argparse.ArgumentParser(description=TITLE_STR)
+    parser.add_argument(
+        '--transfer',
+        choices=TRANSFER_MODES,
+        default=COPY_MODE,
+        help='how images are copied into buckets, falls back to a full copy',
+    )
+    parser.add_argument(
+        '--prefetch-ahead',
+        type=int,
+        default=DEFAULT_PREFETCH_AHEAD,
+        help='next images decoded in the background',
+    )
+    parser.add_argument(
+        '--prefetch-behind',
+        type=int,
+        default=DEFAULT_PREFETCH_BEHIND,
+        help='previous images kept decoded',
+    )
+    parser.add_argument(
+        '--cache-mb',
+        type=int,
+        default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+        help='memory limit of the decoded image cache',
+    )
+    parser.add_argument(
+        '--thumbnail-cache',
+        nargs='?',
+        const=DEFAULT_THUMBNAIL_DIR,
+        help='cache downscaled images between runs, in '
+             f'{DEFAULT_THUMBNAIL_DIR} unless a directory is given',
+    )
+    parser.add_argument(
+        '--thumbnail-cache-mb',
+        type=int,
+        default=DEFAULT_MAX_CACHE_BYTES // (1024 * 1024),
+        help='disk limit of the thumbnail cache, least recently used '
+             'thumbnails are removed on start',
+    )
+    parser.add_argument(
+        '--copy-workers',
+        type=int,
+        default=DEFAULT_COPY_WORKERS,
+        help='threads copying images while you sort',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip images already sorted by a previous (crashed) session',
+    )
+    parser.add_argument(
+        '--fast',
+        action='store_true',
+        help='no confirmation per image, errors go to a status panel',
+    )
+    parser.add_argument(
+        '--undo-depth',
+        type=int,
+        default=DEFAULT_UNDO_DEPTH,
+        help='decisions that can be undone, their copies wait until then',
+    )
+    parser.add_argument(
+        '--rules',
+        help='rules file, matching images are sorted without being shown',
+    )
+    parser.add_argument(
+        '--rule-workers',
+        type=int,
+        default=DEFAULT_RULE_WORKERS,
+        help='threads matching images against the rules',
+    )
+    parser.add_argument(
+        '--headless',
+        action='store_true',
+        help='only apply --rules, without opening the viewer',
+    )
+    parser.add_argument(
+        '--dedup',
+        choices=DEDUP_MODES,
+        help=f'never show near-duplicate images, or copy them to {DUPLICATES_DIR_NAME}',
+    )
+    parser.add_argument(
+        '--dedup-distance',
+        type=int,
+        default=DEFAULT_MAX_DISTANCE,
+        help='differing perceptual hash bits still counted as a duplicate',
+    )
+    args = parser.parse_args()
+    
+    if args.headless:
+        if args.rules is None:
+            parser.error('--headless requires --rules')
+        try:
+            auto_sort_images(
+                args.rules,
+                args.transfer,
+                args.copy_workers,
+                args.rule_workers,
+            )
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        raise SystemExit(0)
+    
+    sorter = ImageBucketSorter(
+        transfer_mode=args.transfer,
+        prefetch_ahead=args.prefetch_ahead,
+        prefetch_behind=args.prefetch_behind,
+        cache_bytes=args.cache_mb * 1024 * 1024,
+        thumbnail_dir=args.thumbnail_cache,
+        thumbnail_cache_bytes=args.thumbnail_cache_mb * 1024 * 1024,
+        copy_workers=args.copy_workers,
+        resume=args.resume,
+        fast_mode=args.fast,
+        undo_depth=args.undo_depth,
+        rules_path=args.rules,
+        rule_workers=args.rule_workers,
+        dedup_mode=args.dedup,
+        dedup_distance=args.dedup_distance,
+    )
     sorter.tk.mainloop()
\ No newline at end of file
@@ -0,0 +1,297 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from PIL import Image
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+AHASH = 'ahash'
+DHASH = 'dhash'
+HASH_ALGORITHMS = [DHASH, AHASH]
+# Grayscale size each image is reduced to before hashing, (width, height)
+HASH_IMAGE_SIZES = {AHASH: (8, 8), DHASH: (9, 8)}
+HASH_BITS = 64
+
+DEFAULT_HASH_CACHE_FILE_NAME = '.image_hash_cache.sqlite3'
+DEFAULT_MAX_DISTANCE = 4  # Differing hash bits still counted as a duplicate
+DEFAULT_HASH_WORKERS = 4
+DEDUP_BATCH_SIZE = 1024  # Images decoded before each vectorized hashing pass
+COMMIT_INTERVAL = 500  # Hashes stored between commits
+
+DUPLICATES_DIR_NAME = 'duplicates'
+DEDUP_SKIP = 'skip'
+DEDUP_BUCKET = 'bucket'  # Copy duplicates to DUPLICATES_DIR_NAME instead
+DEDUP_MODES = [DEDUP_SKIP, DEDUP_BUCKET]
+
+
+def load_hash_pixels(file_path: str, algorithm: str = DHASH) -> np.ndarray:
+    # Tiny grayscale copy of the image, JPEGs are decoded at 1/8 scale
+    size = HASH_IMAGE_SIZES[algorithm]
+    with Image.open(file_path) as image:
+        image.draft('L', (size[0] * 8, size[1] * 8))  # No-op for non-JPEG
+        image = image.convert('L').resize(size, Image.BILINEAR)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def compute_hashes(pixels: np.ndarray, algorithm: str = DHASH) -> np.ndarray:
+    """
+    Hashes a batch of images in one vectorized pass
+
+    aHash: bit set where a pixel is brighter than the image mean
+    dHash: bit set where a pixel is brighter than its left neighbour
+
+    :param pixels: load_hash_pixels output, shape (images, 8, 8 or 9)
+    :param algorithm: AHASH or DHASH
+    :return: 64 bit hashes, shape (images,) uint64
+    """
+    pixels = pixels.astype(np.int16)
+    if algorithm == AHASH:
+        bits = pixels > pixels.mean(axis=(1, 2), keepdims=True)
+    else:
+        bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(pixels), HASH_BITS), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+class ImageHashCache:
+    """
+    SQLite sidecar of perceptual hashes, rows are only reused while the file
+    size and mtime still match.
+
+    NOTE: Not shared between threads, only DuplicateFinder's caller uses it
+    """
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path = cache_path
+        self._uncommitted = 0
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'path TEXT NOT NULL, algorithm TEXT NOT NULL, '
+            'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'hash TEXT NOT NULL, PRIMARY KEY (path, algorithm))'
+        )
+        self.connection.commit()
+
+    def get(
+            self,
+            file_path: str,
+            stat: os.stat_result,
+            algorithm: str
+        ) -> Optional[int]:
+        row = self.connection.execute(
+            'SELECT size, mtime_ns, hash FROM hashes '
+            'WHERE path = ? AND algorithm = ?',
+            (os.path.abspath(file_path), algorithm),
+        ).fetchone()
+        if row is None or row[:2] != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return int(row[2], 16)
+
+    def put(
+            self,
+            file_path: str,
+            stat: os.stat_result,
+            algorithm: str,
+            image_hash: int
+        ) -> None:
+        # Stored as hex, SQLite integers are signed 64 bit
+        self.connection.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+            (
+                os.path.abspath(file_path), algorithm, stat.st_size,
+                stat.st_mtime_ns, f'{image_hash:016x}',
+            ),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+
+class MultiIndexHash:
+    """
+    Finds a stored hash within max_distance bits of a query without comparing
+    against every stored hash.
+
+    Hashes are split into exactly max_distance + 1 chunks, each indexed in
+    its own dict. Two hashes within max_distance bits agree exactly on at
+    least one chunk (pigeonhole), so only hashes sharing a chunk are compared.
+
+    NOTE: Works best for small distances, wide distances mean narrow chunks
+          and large candidate lists
+    NOTE: From HASH_BITS on every hash is within max_distance, find() then
+          compares against every stored hash
+    """
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE) -> None:
+        self.max_distance = max_distance
+        self._chunks: List[Tuple[int, int]] = []  # (shift, mask)
+        chunk_count = max_distance + 1
+        if chunk_count <= HASH_BITS:
+            # The first HASH_BITS % chunk_count chunks are one bit wider
+            chunk_bits, wider_count = divmod(HASH_BITS, chunk_count)
+            shift = 0
+            for i in range(chunk_count):
+                bits = chunk_bits + 1 if i < wider_count else chunk_bits
+                self._chunks.append((shift, (1 << bits) - 1))
+                shift += bits
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._chunks]
+        self._hashes: List[int] = []
+        self._keys: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, image_hash: int, key: str) -> None:
+        index = len(self._hashes)
+        self._hashes.append(image_hash)
+        self._keys.append(key)
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            table.setdefault((image_hash >> shift) & mask, []).append(index)
+
+    def find(self, image_hash: int) -> Optional[str]:
+        # Key of the closest stored hash within max_distance, None otherwise
+        best = None
+        best_distance = self.max_distance + 1
+        if not self._chunks:
+            for index, stored_hash in enumerate(self._hashes):
+                distance = (stored_hash ^ image_hash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = index, distance
+            return None if best is None else self._keys[best]
+
+        seen = set()
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            for index in table.get((image_hash >> shift) & mask, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                distance = (self._hashes[index] ^ image_hash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = index, distance
+        return None if best is None else self._keys[best]
+
+
+class DuplicateFinder:
+    """
+    Flags images that are perceptually the same as an image seen before them
+    (resized, re-encoded or slightly edited copies).
+
+    The first image of a group is the original, every later one within
+    max_distance bits of it is its duplicate.
+
+    NOTE: Images are decoded on worker threads, hashing is vectorized per
+          batch, with cache_path unchanged images are not decoded again
+    NOTE: Unreadable images are never flagged, callers handle them as usual
+    """
+    def __init__(
+            self,
+            max_distance: int = DEFAULT_MAX_DISTANCE,
+            algorithm: str = DHASH,
+            cache_path: Optional[str] = None,
+            workers: int = DEFAULT_HASH_WORKERS
+        ) -> None:
+        self.algorithm = algorithm
+        self.index = MultiIndexHash(max_distance)
+        self.cache = ImageHashCache(cache_path) if cache_path else None
+        self.duplicate_count = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def find_batch(self, file_paths: List[str]) -> List[Optional[str]]:
+        """
+        Checks a batch of images in order, against earlier batches too
+
+        :param file_paths: image paths
+        :return: path of the original for each duplicate, None otherwise
+        """
+        hashes = self._get_hashes(file_paths)
+        originals = []
+        for file_path, image_hash in zip(file_paths, hashes):
+            original = None
+            if image_hash is not None:
+                original = self.index.find(image_hash)
+                if original is None:
+                    self.index.add(image_hash, file_path)
+                else:
+                    self.duplicate_count += 1
+            originals.append(original)
+        return originals
+
+    def find_all(
+            self,
+            file_paths: Iterable[str],
+            on_progress: Optional[Callable[[int], None]] = None
+        ) -> Dict[str, str]:
+        # {duplicate path: original path}. Paths are read DEDUP_BATCH_SIZE at
+        # a time, on_progress gets the amount of images checked so far
+        duplicates = {}
+        done_count = 0
+        file_paths = iter(file_paths)
+        batch = list(islice(file_paths, DEDUP_BATCH_SIZE))
+        while batch:
+            for file_path, original in zip(batch, self.find_batch(batch)):
+                if original is not None:
+                    duplicates[file_path] = original
+            done_count += len(batch)
+            if on_progress is not None:
+                on_progress(done_count)
+            batch = list(islice(file_paths, DEDUP_BATCH_SIZE))
+        return duplicates
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _get_hashes(self, file_paths: List[str]) -> List[Optional[int]]:
+        hashes: List[Optional[int]] = [None] * len(file_paths)
+        stats: List[Optional[os.stat_result]] = [None] * len(file_paths)
+        missing = []
+        for i, file_path in enumerate(file_paths):
+            try:
+                stats[i] = os.stat(file_path)
+            except OSError:
+                continue
+            if self.cache is not None:
+                hashes[i] = self.cache.get(file_path, stats[i], self.algorithm)
+            if hashes[i] is None:
+                missing.append(i)
+        if not missing:
+            return hashes
+
+        loaded = self._executor.map(
+            lambda i: _load_hash_pixels_safe(file_paths[i], self.algorithm),
+            missing,
+        )
+        decoded: List[Tuple[int, np.ndarray]] = [
+            (i, pixels) for i, pixels in zip(missing, loaded)
+            if pixels is not None
+        ]
+        if not decoded:
+            return hashes
+
+        new_hashes = compute_hashes(
+            np.stack([pixels for _, pixels in decoded]),
+            self.algorithm,
+        )
+        for (i, _), image_hash in zip(decoded, new_hashes.tolist()):
+            hashes[i] = image_hash
+            if self.cache is not None:
+                self.cache.put(file_paths[i], stats[i], self.algorithm, image_hash)
+        return hashes
+
+
+def _load_hash_pixels_safe(
+        file_path: str,
+        algorithm: str
+    ) -> Optional[np.ndarray]:
+    try:
+        return load_hash_pixels(file_path, algorithm)
+    except Exception:
+        return None
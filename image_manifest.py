@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+
+from typing import Optional, Tuple
+
+DEFAULT_MANIFEST_FILE_NAME = '.group_images_manifest.sqlite3'
+COMMIT_INTERVAL = 500  # Copies recorded between commits
+
+
+class ImageManifest:
+    """
+    SQLite sidecar recording measured dimensions and finished copies, so a
+    re-run skips unchanged images and an interrupted run picks up where it
+    stopped.
+
+    Rows are keyed by paths relative to root_dir and only reused while the
+    file size and mtime still match.
+
+    NOTE: Copies are only recorded after they finish, at worst the last
+          COMMIT_INTERVAL copies of a crashed run are repeated
+    NOTE: Safe to share between threads
+    """
+    def __init__(self, manifest_path: str, root_dir: str) -> None:
+        self.manifest_path = manifest_path
+        self.root_dir = root_dir
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self.connection = sqlite3.connect(
+            manifest_path,
+            check_same_thread=False,
+        )
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS images ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, oriented INTEGER NOT NULL, '
+            'width INTEGER NOT NULL, height INTEGER NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS copies ('
+            'path TEXT NOT NULL, dst_dir TEXT NOT NULL, '
+            'PRIMARY KEY (path, dst_dir));'
+        )
+        self.connection.commit()
+
+    def get_size(
+            self,
+            file_path: str,
+            stat: os.stat_result,
+            oriented: bool = False
+        ) -> Optional[Tuple[int, int]]:
+        # Returns None when the image is not recorded, has changed since or
+        # was measured with a different EXIF orientation setting
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT size, mtime_ns, oriented, width, height FROM images '
+                'WHERE path = ?',
+                (self._relpath(file_path),),
+            ).fetchone()
+        if row is None or row[:3] != (stat.st_size, stat.st_mtime_ns, oriented):
+            return None
+        return row[3], row[4]
+
+    def put_size(
+            self,
+            file_path: str,
+            stat: os.stat_result,
+            size: Tuple[int, int],
+            oriented: bool = False
+        ) -> None:
+        # A changed image forgets its previous copies
+        path = self._relpath(file_path)
+        with self._lock:
+            self.connection.execute('DELETE FROM copies WHERE path = ?', (path,))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    path, stat.st_size, stat.st_mtime_ns, int(oriented),
+                    size[0], size[1],
+                ),
+            )
+
+    def is_copied(self, file_path: str, dst_dir: str) -> bool:
+        # Also checks the copy is still on disk
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM copies WHERE path = ? AND dst_dir = ?',
+                (self._relpath(file_path), self._relpath(dst_dir)),
+            ).fetchone()
+        dst_path = os.path.join(dst_dir, os.path.basename(file_path))
+        return row is not None and os.path.isfile(dst_path)
+
+    def mark_copied(self, file_path: str, dst_dir: str) -> None:
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO copies VALUES (?, ?)',
+                (self._relpath(file_path), self._relpath(dst_dir)),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_INTERVAL:
+                self.connection.commit()
+                self._uncommitted = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.root_dir)
@@ -0,0 +1,185 @@
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+from thumbnail_cache import ThumbnailCache
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_PREFETCH_AHEAD = 3
+DEFAULT_PREFETCH_BEHIND = 1
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_PREFETCH_WORKERS = 2
+
+# (original width, original height), scaled image
+LoadedImage = Tuple[Tuple[int, int], Image.Image]
+
+
+def get_scaled_size(
+        size: Tuple[int, int],
+        max_width: int,
+        max_height: int
+    ) -> Tuple[int, int]:
+    # Only need to use the largest scaling ratio to guarantee it is within bounds
+    width, height = size
+    scaling_ratio = max([width / max_width, height / max_height])
+    if scaling_ratio > 1:
+        new_width = int(width * (1 / scaling_ratio))
+        new_height = int(height * (1 / scaling_ratio))
+        return new_width, new_height
+    return width, height
+
+
+def load_scaled_image(
+        file_path: str,
+        max_width: int,
+        max_height: int,
+        thumbnail_cache: Optional[ThumbnailCache] = None
+    ) -> LoadedImage:
+    # Decodes and scales one image, the file is closed before returning.
+    # JPEGs are decoded at 1/2, 1/4 or 1/8 scale when that still covers the
+    # scaled size, a thumbnail cache hit skips decoding entirely
+    stat = os.stat(file_path)
+    if thumbnail_cache is not None:
+        cached = thumbnail_cache.get(file_path, stat)
+        if cached is not None:
+            return cached
+    
+    with Image.open(file_path) as image:
+        size = image.size
+        scaled_size = get_scaled_size(size, max_width, max_height)
+        if scaled_size != size:
+            image.draft(None, scaled_size)  # No-op for non-JPEG formats
+            scaled = image.resize(scaled_size)
+        else:
+            scaled = image.copy()  # Fully loaded copy outlives the file
+    
+    if thumbnail_cache is not None:
+        thumbnail_cache.put(file_path, stat, size, scaled)
+    return size, scaled
+
+
+class ImagePrefetcher:
+    """
+    Decodes and scales images around the current one on background threads
+    into a size-bounded LRU cache, so advancing is usually a cache hit.
+
+    NOTE: Only PIL images are built off the Tk thread, ImageTk.PhotoImage
+          must still be created on the Tk thread
+    NOTE: Cache size is estimated from decoded pixel bytes
+    NOTE: With a thumbnail_cache, scaled images also persist between runs
+    NOTE: Failed decodes are remembered, get() re-raises them and they are
+          never prefetched again
+    """
+    def __init__(
+            self,
+            file_paths: List[str],
+            max_width: int,
+            max_height: int,
+            ahead: int = DEFAULT_PREFETCH_AHEAD,
+            behind: int = DEFAULT_PREFETCH_BEHIND,
+            max_cache_bytes: int = DEFAULT_CACHE_BYTES,
+            workers: int = DEFAULT_PREFETCH_WORKERS,
+            thumbnail_cache: Optional[ThumbnailCache] = None,
+        ) -> None:
+        self.file_paths = file_paths
+        self.max_width = max_width
+        self.max_height = max_height
+        self.ahead = ahead
+        self.behind = behind
+        self.max_cache_bytes = max_cache_bytes
+        self.thumbnail_cache = thumbnail_cache
+        self.hit_count = 0
+        self.miss_count = 0
+
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[int, LoadedImage]' = OrderedDict()
+        self._cache_bytes = 0
+        self._pending: Dict[int, Future] = {}
+        self._failed: Dict[int, Exception] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def get(self, index: int) -> LoadedImage:
+        """
+        Returns the image at index, waiting for a pending prefetch or
+        decoding it here if needed, then prefetches its neighbours
+
+        :param index: index into file_paths
+        :return: ((original width, original height), scaled image)
+        """
+        with self._lock:
+            loaded = self._cache.get(index)
+            future = self._pending.get(index)
+            error = self._failed.get(index)
+            if loaded is not None:
+                self._cache.move_to_end(index)
+                self.hit_count += 1
+            else:
+                self.miss_count += 1
+
+        try:
+            if error is not None:
+                raise error
+            if loaded is None and future is not None:
+                loaded = future.result()
+            elif loaded is None:
+                loaded = self._load(index)
+        finally:
+            self.prefetch_around(index)
+        return loaded
+
+    def prefetch_around(self, index: int) -> None:
+        # Closest images first, next ones before previous ones
+        indexes = [index + i for i in range(1, self.ahead + 1)]
+        indexes += [index - i for i in range(1, self.behind + 1)]
+        with self._lock:
+            for i in indexes:
+                if not 0 <= i < len(self.file_paths):
+                    continue
+                if i in self._cache or i in self._pending or i in self._failed:
+                    continue
+                self._pending[i] = self._executor.submit(self._load, i)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+            self._failed.clear()
+
+    def _load(self, index: int) -> LoadedImage:
+        try:
+            loaded = load_scaled_image(
+                self.file_paths[index],
+                self.max_width,
+                self.max_height,
+                self.thumbnail_cache,
+            )
+        except Exception as e:
+            with self._lock:
+                self._failed[index] = e
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(index, None)
+        self._add_to_cache(index, loaded)
+        return loaded
+
+    def _add_to_cache(self, index: int, loaded: LoadedImage) -> None:
+        with self._lock:
+            if index in self._cache:
+                return
+            self._cache[index] = loaded
+            self._cache_bytes += _get_image_bytes(loaded[1])
+            # Evict least recently used, always keeping the newest image
+            while (
+                self._cache_bytes > self.max_cache_bytes
+                and len(self._cache) > 1
+            ):
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= _get_image_bytes(evicted[1])
+
+
+def _get_image_bytes(image: Image.Image) -> int:
+    return image.size[0] * image.size[1] * len(image.getbands())
@@ -0,0 +1,127 @@
+import struct
+
+from PIL import Image
+from typing import BinaryIO, Optional, Tuple
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SOI = b'\xff\xd8'
+
+# SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}  # RSTn, SOI, EOI, TEM
+JPEG_APP1_MARKER = 0xE1
+EXIF_HEADER = b'Exif\x00\x00'
+EXIF_ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}  # Width and height are swapped on display
+
+# Bytes buffered per read, headers are read piecewise and other data skipped
+PROBE_BUFFER_SIZE = 8 * 1024
+
+
+def probe_image_size(
+        file_path: str,
+        apply_orientation: bool = False
+    ) -> Tuple[int, int]:
+    """
+    Reads image dimensions from PNG IHDR or JPEG SOFn headers without decoding
+    the image, other formats fall back to Pillow.
+
+    The file is closed before returning in every case.
+
+    :param file_path: image path
+    :param apply_orientation: swap width and height for EXIF orientations 5-8
+                              (rotated by 90 degrees on display)
+    :return: (width, height), same as Image.size unless apply_orientation
+    """
+    with open(file_path, 'rb', buffering=PROBE_BUFFER_SIZE) as f:
+        signature = f.read(len(PNG_SIGNATURE))
+        f.seek(0)
+        if signature == PNG_SIGNATURE:
+            probed = _probe_png(f)
+        elif signature[:2] == JPEG_SOI:
+            probed = _probe_jpeg(f)
+        else:
+            probed = None
+
+    if probed is None:  # Other formats or malformed headers
+        with Image.open(file_path) as img:
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            probed = (img.size[0], img.size[1], orientation)
+
+    width, height, orientation = probed
+    if apply_orientation and orientation in ROTATED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def _probe_png(f: BinaryIO) -> Optional[Tuple[int, int, int]]:
+    # Signature, IHDR length and type, then 4 byte width and height
+    data = f.read(24)
+    if len(data) < 24 or data[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', data[16:24])
+    return width, height, 1
+
+
+def _probe_jpeg(f: BinaryIO) -> Optional[Tuple[int, int, int]]:
+    # Walks marker segments until the first SOFn, seeking over segment data
+    f.read(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if byte != b'\xff':
+            return None
+        marker = f.read(1)
+        while marker == b'\xff':  # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+
+        length_data = f.read(2)
+        if len(length_data) < 2:
+            return None
+        length = struct.unpack('>H', length_data)[0] - 2
+        if length < 0:
+            return None
+
+        if marker in JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height, orientation
+        elif marker == JPEG_APP1_MARKER and orientation == 1:
+            segment = f.read(length)
+            orientation = _read_exif_orientation(segment)
+        else:
+            f.seek(length, 1)
+
+
+def _read_exif_orientation(segment: bytes) -> int:
+    # Orientation from IFD0 of an APP1 Exif segment, 1 (normal) if missing
+    if not segment.startswith(EXIF_HEADER):
+        return 1
+    tiff = segment[len(EXIF_HEADER):]
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return 1
+
+    try:
+        ifd_offset = struct.unpack(order + 'I', tiff[4:8])[0]
+        count_data = tiff[ifd_offset:ifd_offset + 2]
+        entry_count = struct.unpack(order + 'H', count_data)[0]
+        for i in range(entry_count):
+            entry = ifd_offset + 2 + i * 12
+            tag = struct.unpack(order + 'H', tiff[entry:entry + 2])[0]
+            if tag == EXIF_ORIENTATION_TAG:
+                value_data = tiff[entry + 8:entry + 10]
+                return struct.unpack(order + 'H', value_data)[0]
+    except struct.error:  # Truncated Exif data
+        pass
+    return 1
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import struct
+
+from typing import Tuple
+
+# Bytes hashed per read, files are never loaded whole
+HASH_CHUNK_SIZE = 1024 * 1024
+
+ID3V2_HEADER_SIZE = 10
+ID3V2_FOOTER_FLAG = 0x10  # v2.4, a 10 byte footer follows the tag
+ID3V1_SIZE = 128
+ID3V1_ENHANCED_SIZE = 227  # 'TAG+' block in front of an ID3v1 tag
+APE_FOOTER_SIZE = 32
+APE_HEADER_FLAG = 0x80000000
+
+
+def get_audio_range(file_path: str) -> Tuple[int, int]:
+    """
+    Finds the audio payload between leading ID3v2 tags and trailing APEv2,
+    enhanced ID3v1 and ID3v1 tags, so retagged copies of a track match
+
+    :param file_path: path to an mp3 file
+    :return: (start, end) byte offsets of the audio payload
+    """
+    end = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        # Leading ID3v2 tags, some taggers write more than one
+        start = 0
+        while start + ID3V2_HEADER_SIZE <= end:
+            f.seek(start)
+            header = f.read(ID3V2_HEADER_SIZE)
+            if header[:3] != b'ID3' or any(b & 0x80 for b in header[6:10]):
+                break
+            start += ID3V2_HEADER_SIZE + _syncsafe(header[6:10])
+            if header[5] & ID3V2_FOOTER_FLAG:
+                start += ID3V2_HEADER_SIZE
+
+        # Trailing tags, ID3v1 is always last
+        if end - start >= ID3V1_SIZE:
+            f.seek(end - ID3V1_SIZE)
+            if f.read(3) == b'TAG':
+                end -= ID3V1_SIZE
+                if end - start >= ID3V1_ENHANCED_SIZE:
+                    f.seek(end - ID3V1_ENHANCED_SIZE)
+                    if f.read(4) == b'TAG+':
+                        end -= ID3V1_ENHANCED_SIZE
+        if end - start >= APE_FOOTER_SIZE:
+            f.seek(end - APE_FOOTER_SIZE)
+            footer = f.read(APE_FOOTER_SIZE)
+            if footer[:8] == b'APETAGEX':
+                size, _, flags = struct.unpack('<III', footer[12:24])
+                if flags & APE_HEADER_FLAG:
+                    size += APE_FOOTER_SIZE
+                end = max(start, end - size)
+    return start, max(start, end)
+
+
+def hash_audio_payload(file_path: str) -> str:
+    """
+    BLAKE2b digest of the audio payload only, read in HASH_CHUNK_SIZE chunks
+
+    :param file_path: path to an mp3 file
+    :return: hex digest, equal for tracks that only differ in their tags
+    """
+    start, end = get_audio_range(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
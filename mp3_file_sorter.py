@@ -1,17 +1,118 @@
+import argparse
+import filecmp
 import os
 import shutil
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from file_catalog import FileCatalog
+from file_scanner import scan_files
+from file_transfer import COPY_MODE, FileTransfer, TRANSFER_MODES
+from id3_fast_reader import read_sort_frames
+from mp3_audio_hash import hash_audio_payload
+from mp3_tag_index import DEFAULT_INDEX_FILE_NAME, MP3TagIndex
 from mutagen.easyid3 import EasyID3
+from run_metrics import (
+    add_metrics_arguments,
+    profile_run,
+    RunMetrics,
+    write_metrics,
+)
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Destination folder names for files that cannot be sorted further
+NOT_MP3_FOLDER = 'Not MP3'
+NO_TAG_FOLDER = 'None'
+
+# Only tags needed to compute the 'genre/artist/album' destination
+SORT_TAGS = ['genre', 'artist', 'albumartist', 'album']
+
+# Tag extraction defaults
+DEFAULT_WORKERS = 1
+PENDING_FILES_PER_WORKER = 4  # Bounds the extraction queue
+METRICS_NAME = 'mp3_file_sorter'
+
+
+def read_sort_tags(file_path: str, fast: bool = True) -> Dict[str, str]:
+    # Parses the file once and keeps only the first non-empty sort tags.
+    # The fast path reads the raw frames, odd files fall back to mutagen
+    if fast:
+        tags = read_sort_frames(file_path)
+        if tags is not None:
+            return {k: v.replace('/', ' ') for k, v in tags.items()}
+    
+    tags = EasyID3(file_path)
+    return {
+        k: tags[k][0].replace('/', ' ') for k in SORT_TAGS
+        if k in tags and tags[k] and tags[k][0] != ''
+    }
+
+
+def hash_audio_payload_safe(
+        file_path: str
+    ) -> Tuple[str, Optional[str], Optional[str]]:
+    # (file_path, audio hash, error)
+    try:
+        return file_path, hash_audio_payload(file_path), None
+    except Exception as error:
+        return file_path, None, str(error)
+
+
+def read_sort_tags_safe(
+        file_path: str,
+        fast: bool = True
+    ) -> Tuple[str, Dict[str, str], Optional[str]]:
+    # Module level so it can be pickled for process pool workers
+    try:
+        return file_path, read_sort_tags(file_path, fast), None
+    except Exception as error:
+        return file_path, {}, str(error)
 
 
 # TODO this script is old, untested on latest Python/Mutagen
 # TODO add tests and more comments
 class MP3FileSorter:
-    def __init__(self):
+    def __init__(
+            self,
+            workers: int = DEFAULT_WORKERS,
+            use_processes: bool = False,
+            index: Optional[MP3TagIndex] = None,
+            fast_tags: bool = True,
+            transfer_mode: str = COPY_MODE,
+            recursive: bool = False,
+            dedup: bool = False,
+            metrics: Optional[RunMetrics] = None,
+            verbose: bool = False,
+        ):
+        # Stages: scan, tags, index, hash, transfer. Only errors and
+        # summaries are printed unless verbose
+        self.metrics = metrics if metrics is not None else RunMetrics(METRICS_NAME)
+        self.verbose = verbose
+        self.recursive = recursive  # Also sort files in source subfolders
+        self.dedup = dedup  # Skip tracks whose audio was seen before
+        self._audio_hashes: Dict[str, str] = {}  # Source path -> audio hash
+        self.duplicate_count = 0
+        self.error_count = 0
+        self.workers = max(1, workers)
+        self.use_processes = use_processes
+        self.index = index  # Skips parsing unchanged files when set
+        self.fast_tags = fast_tags  # Raw ID3v2 frame reader before mutagen
+        self.file_transfer = FileTransfer(transfer_mode)
         self.DESTINATION = os.path.join(self.get_current_directory(), 'dest')
         self.SOURCE = os.path.join(self.get_current_directory(), 'source')
         
-    def sort_from_source(self) -> None:
+    def sort_from_source(self, dry_run: bool = False) -> None:
+        # Single pass: tags are read once and every file is transferred once
+        plan = self.plan_from_source(self.SOURCE)
+        if self.dedup:
+            plan = self.dedup_plan(plan)
+        if dry_run:
+            self.print_plan(plan)
+        else:
+            self.execute_plan(plan)
+    
+    def sort_from_source_legacy(self) -> None:
+        # Original three sweep sort, kept for comparison with the planner
         self.sort_by_genre(self.SOURCE)
     
         for genre_name in os.listdir(self.DESTINATION):
@@ -26,7 +127,8 @@ class MP3FileSorter:
     def sort_by_genre(self, directory: str):
         for filename in os.listdir(directory):
             file_path = os.path.join(directory, filename)
-            print('PROCESSING GENRE...', file_path)
+            if self.verbose:
+                print('PROCESSING GENRE...', file_path)
     
             if file_path[-3:] != 'mp3':
                 self.copy_to_folder('Not MP3', file_path)
@@ -44,7 +146,8 @@ class MP3FileSorter:
         new_destination = os.path.join(self.DESTINATION, directory)
         for filename in os.listdir(directory):
             file_path = os.path.join(directory, filename)
-            print('PROCESSING ARTIST...', file_path)
+            if self.verbose:
+                print('PROCESSING ARTIST...', file_path)
     
             try:
                 tags = EasyID3(file_path)
@@ -65,7 +168,8 @@ class MP3FileSorter:
     def sort_by_album(self, directory):
         for filename in os.listdir(directory):
             file_path = os.path.join(directory, filename)
-            print('PROCESSING ALBUM...', file_path)
+            if self.verbose:
+                print('PROCESSING ALBUM...', file_path)
     
             try:
                 tags = EasyID3(file_path)
@@ -79,31 +183,312 @@ class MP3FileSorter:
             else:
                 self.move_to_folder(directory, 'None', file_path)
     
+    def iter_tags(
+            self,
+            file_paths: Iterable[str]
+        ) -> Iterator[Tuple[str, Dict[str, str], Optional[str]]]:
+        # Yields (file_path, tags, error) in input order. With more than one
+        # worker, at most workers * PENDING_FILES_PER_WORKER files are queued
+        if self.workers == 1:
+            for file_path in file_paths:
+                yield read_sort_tags_safe(file_path, self.fast_tags)
+            return
+        
+        if self.use_processes:
+            executor_class = ProcessPoolExecutor
+        else:
+            executor_class = ThreadPoolExecutor
+        max_pending = self.workers * PENDING_FILES_PER_WORKER
+        
+        with executor_class(max_workers=self.workers) as executor:
+            pending = deque()
+            for file_path in file_paths:
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(
+                    read_sort_tags_safe, file_path, self.fast_tags
+                ))
+            while pending:
+                yield pending.popleft().result()
+    
+    def iter_audio_hashes(
+            self,
+            file_paths: Iterable[str]
+        ) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        # Yields (file_path, audio hash, error) in input order, same queue
+        # bound as iter_tags. Always threads, hashlib releases the GIL
+        max_pending = self.workers * PENDING_FILES_PER_WORKER
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for file_path in file_paths:
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(hash_audio_payload_safe, file_path))
+            while pending:
+                yield pending.popleft().result()
+    
+    def dedup_plan(self, plan: FileCatalog) -> FileCatalog:
+        # Drops mp3 files whose audio (tags excluded) is earlier in the plan
+        # or, with an index, already in the library from a previous import
+        first_paths: Dict[str, str] = {}  # Audio hash -> first file path
+        duplicates = set()
+        mp3_paths = (p for p, sub_folder in plan.items() if sub_folder != NOT_MP3_FOLDER)
+        hashes = self.metrics.timed_iter('hash', self.iter_audio_hashes(mp3_paths))
+        for file_path, audio_hash, error in hashes:
+            if error is not None:
+                self.metrics.count('hash_errors')
+                print(error)
+                continue
+            original = first_paths.get(audio_hash)
+            if original is None and self.index is not None:
+                original = self.index.get_hash_path(audio_hash)
+            if original is not None:
+                if self.verbose:
+                    print(f'DUPLICATE {file_path} of {original}')
+                duplicates.add(file_path)
+                continue
+            first_paths[audio_hash] = file_path
+            self._audio_hashes[file_path] = audio_hash
+        
+        self.duplicate_count += len(duplicates)
+        self.metrics.count('duplicates', len(duplicates))
+        print(f'{len(duplicates)} duplicate tracks skipped')
+        return plan.select(
+            i for i, file_path in enumerate(plan) if file_path not in duplicates
+        )
+    
+    def get_target_folder(self, tags: Dict[str, str]) -> str:
+        # Same rules as sort_by_genre -> sort_by_artist -> sort_by_album
+        if 'genre' not in tags:
+            return NO_TAG_FOLDER
+        artist = tags.get('artist', tags.get('albumartist', NO_TAG_FOLDER))
+        album = tags.get('album', NO_TAG_FOLDER)
+        return os.path.join(tags['genre'], artist, album)
+    
+    def plan_from_source(self, directory: str) -> FileCatalog:
+        # Returns a catalog of file paths labelled with their sub_folder,
+        # relative to DESTINATION. Folder names are interned, so a plan of
+        # millions of files costs a few arrays instead of a list of tuples
+        # Scan time is measured inside the tags stage, stages are exclusive
+        plan = FileCatalog()
+        mp3_paths = self.metrics.timed_iter(
+            'scan', self.scan_for_extraction(directory, plan)
+        )
+        results = self.metrics.timed_iter('tags', self.iter_tags(mp3_paths))
+        for file_path, tags, error in results:
+            if error is not None:
+                self.metrics.count('tag_errors')
+                print(error)
+            elif self.index is not None:
+                with self.metrics.stage('index'):
+                    self.index.put(file_path, os.stat(file_path), tags)
+            plan.add(file_path, bucket=self.get_target_folder(tags))
+        self.metrics.count('files_planned', len(plan))
+        
+        if self.index is not None:
+            self.index.commit()
+        return plan
+    
+    def scan_for_extraction(
+            self,
+            directory: str,
+            plan: FileCatalog
+        ) -> Iterator[str]:
+        # Lazily yields mp3 paths that need their tags read, so extraction
+        # starts while the scan is still running. Files that do not need
+        # extraction are added to plan directly
+        for entry in scan_files(directory, recursive=self.recursive):
+            file_path = entry.path
+            if file_path[-3:] != 'mp3':
+                plan.add(file_path, bucket=NOT_MP3_FOLDER)
+                continue
+            
+            if self.index is not None:
+                with self.metrics.stage('index'):
+                    tags = self.index.get(file_path, entry.stat())
+                if tags is not None:
+                    self.metrics.count('index_hits')
+                    plan.add(file_path, bucket=self.get_target_folder(tags))
+                    continue
+            yield file_path
+    
+    def print_plan(self, plan: FileCatalog) -> None:
+        for file_path, sub_folder in plan.items():
+            print(f'{file_path} -> {os.path.join(self.DESTINATION, sub_folder)}')
+        print(f'{len(plan)} files planned')
+    
+    def execute_plan(self, plan: FileCatalog) -> None:
+        for file_path, sub_folder in plan.items():
+            if self.verbose:
+                print('PROCESSING...', file_path)
+            dst = self.copy_to_folder(sub_folder, file_path)
+            audio_hash = self._audio_hashes.get(file_path)
+            if dst is not None and audio_hash is not None and self.index is not None:
+                self.index.put_hash(audio_hash, dst)
+        
+        if self.index is not None:
+            self.index.commit()
+        print(f'{len(plan)} files processed, {self.error_count} errors')
     
     def get_current_directory(self) -> str:
         return os.path.dirname(os.path.realpath(__file__))
     
     
-    def copy_to_folder(self, sub_folder: str, file_path: str) -> None:
+    def copy_to_folder(self, sub_folder: str, file_path: str) -> Optional[str]:
+        # Returns the new file path, None if skipped or failed
+        target = os.path.join(self.DESTINATION, sub_folder)
         try:
-            target = os.path.join(self.DESTINATION, sub_folder)
             if not os.path.exists(target):
                 os.makedirs(target)
-            shutil.copy2(file_path, target)
-        except Exception:
-            pass
+            dst = self.get_free_path(target, file_path)
+            if dst is None:
+                self.metrics.count('already_in_dest')
+                if self.verbose:
+                    print(f'ALREADY IN {target}', file_path)
+                return None
+            with self.metrics.stage('transfer'):
+                dst = self.file_transfer.transfer(file_path, dst)
+            self.metrics.count('files_copied')
+            self.metrics.count('bytes_copied', os.path.getsize(dst))
+            return dst
+        except Exception as error:
+            self.error_count += 1
+            self.metrics.count('transfer_errors')
+            print(f'ERROR copying {file_path} to {target}: {type(error)} {error}')
+            return None
     
     
-    def move_to_folder(self, sub_folder: str, file_path: str):
+    def move_to_folder(
+            self,
+            directory: str,
+            sub_folder: str,
+            file_path: str
+        ) -> Optional[str]:
+        target = os.path.join(self.DESTINATION, directory, sub_folder)
         try:
-            target = os.path.join(self.DESTINATION, sub_folder)
             if not os.path.exists(target):
                 os.makedirs(target)
-            shutil.move(file_path, target)
-        except Exception:
-            pass
+            dst = self.get_free_path(target, file_path)
+            if dst is None:  # Left in place, never deleted
+                self.metrics.count('already_in_dest')
+                if self.verbose:
+                    print(f'ALREADY IN {target}', file_path)
+                return None
+            with self.metrics.stage('transfer'):
+                dst = shutil.move(file_path, dst)
+            self.metrics.count('files_moved')
+            return dst
+        except Exception as error:
+            self.error_count += 1
+            self.metrics.count('transfer_errors')
+            print(f'ERROR moving {file_path} to {target}: {type(error)} {error}')
+            return None
+    
+    def get_free_path(self, target: str, file_path: str) -> Optional[str]:
+        # Destination for file_path in target. None when a file with the same
+        # name and content is already there, other name clashes get a ' (2)',
+        # ' (3)', ... suffix instead of being overwritten
+        name, ext = os.path.splitext(os.path.basename(file_path))
+        dst = os.path.join(target, name + ext)
+        copy_number = 1
+        while os.path.exists(dst):
+            if os.path.samefile(file_path, dst) or self.is_same_content(file_path, dst):
+                return None
+            copy_number += 1
+            dst = os.path.join(target, f'{name} ({copy_number}){ext}')
+        return dst
+    
+    def is_same_content(self, file_path: str, other_path: str) -> bool:
+        # mp3 files compare audio only, so retagged copies still match
+        if file_path[-3:] != 'mp3':
+            return filecmp.cmp(file_path, other_path, shallow=False)
+        audio_hash = self._audio_hashes.get(file_path)
+        if audio_hash is None:
+            audio_hash = hash_audio_payload(file_path)
+            self._audio_hashes[file_path] = audio_hash
+        return audio_hash == hash_audio_payload(other_path)
 
 
 if __name__ == "__main__":
-    sorter = MP3FileSorter()
-    sorter.sort_from_source()
+    parser = argparse.ArgumentParser(description='Sort mp3 files by ID3 tags')
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='print the genre/artist/album plan without copying any files',
+    )
+    parser.add_argument(
+        '--recursive',
+        action='store_true',
+        help='also sort files in subfolders of source',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help='number of tag extraction workers',
+    )
+    parser.add_argument(
+        '--processes',
+        action='store_true',
+        help='extract tags in a process pool instead of a thread pool',
+    )
+    parser.add_argument(
+        '--no-fast-tags',
+        action='store_true',
+        help='always read tags with mutagen instead of the raw frame reader',
+    )
+    parser.add_argument(
+        '--transfer',
+        choices=TRANSFER_MODES,
+        default=COPY_MODE,
+        help='how files are copied into dest, falls back to a full copy',
+    )
+    parser.add_argument(
+        '--index',
+        nargs='?',
+        const=DEFAULT_INDEX_FILE_NAME,
+        help='reuse tags of unchanged files from this SQLite index',
+    )
+    parser.add_argument(
+        '--invalidate-index',
+        action='store_true',
+        help='drop every entry from the --index file and exit',
+    )
+    parser.add_argument(
+        '--compact-index',
+        action='store_true',
+        help='drop entries for missing files, shrink the --index file and exit',
+    )
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='skip tracks whose audio (tags excluded) was already seen, '
+             'with --index also across previous imports',
+    )
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    if (args.invalidate_index or args.compact_index) and not args.index:
+        parser.error('--invalidate-index and --compact-index require --index')
+    
+    index = MP3TagIndex(args.index) if args.index else None
+    if args.invalidate_index:
+        print(f'{index.invalidate()} index entries removed')
+    elif args.compact_index:
+        print(f'{index.compact()} index entries removed')
+    else:
+        sorter = MP3FileSorter(
+            workers=args.workers,
+            use_processes=args.processes,
+            index=index,
+            fast_tags=not args.no_fast_tags,
+            transfer_mode=args.transfer,
+            recursive=args.recursive,
+            dedup=args.dedup,
+            verbose=args.verbose,
+        )
+        with profile_run(sorter.metrics, args.profile, args.trace_memory):
+            sorter.sort_from_source(dry_run=args.dry_run)
+        write_metrics(sorter.metrics, args)
+    
+    if index is not None:
+        index.close()
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+
+from typing import Dict, Optional
+
+DEFAULT_INDEX_FILE_NAME = 'mp3_tag_index.sqlite3'
+INDEXED_TAGS = ['genre', 'artist', 'albumartist', 'album']
+
+
+class MP3TagIndex:
+    """
+    On-disk SQLite index of the sort tags read from each mp3 file.
+
+    Rows are keyed by path and only reused while the file size and mtime
+    still match, so a changed file is always parsed again.
+
+    NOTE: Missing tags are stored as NULL and left out of returned dicts
+    NOTE: Also maps audio payload hashes (mp3_audio_hash.py) to the library
+          file holding that audio, so imports spot known tracks in O(1)
+    """
+    def __init__(self, index_path: str) -> None:
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tags ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, '
+            + ', '.join(f'{t} TEXT' for t in INDEXED_TAGS)
+            + ')'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS audio_hashes ('
+            'hash TEXT PRIMARY KEY, path TEXT NOT NULL)'
+        )
+        self.connection.commit()
+
+    def get(
+            self,
+            file_path: str,
+            stat: os.stat_result
+        ) -> Optional[Dict[str, str]]:
+        # Returns None when the file is not indexed or has changed since
+        row = self.connection.execute(
+            f'SELECT size, mtime_ns, {", ".join(INDEXED_TAGS)} '
+            'FROM tags WHERE path = ?',
+            (file_path,),
+        ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return {t: v for t, v in zip(INDEXED_TAGS, row[2:]) if v is not None}
+
+    def put(
+            self,
+            file_path: str,
+            stat: os.stat_result,
+            tags: Dict[str, str]
+        ) -> None:
+        # Not committed until commit() so large runs write in one transaction
+        self.connection.execute(
+            f'INSERT OR REPLACE INTO tags VALUES (?, ?, ?, '
+            f'{", ".join("?" for _ in INDEXED_TAGS)})',
+            (file_path, stat.st_size, stat.st_mtime_ns)
+            + tuple(tags.get(t) for t in INDEXED_TAGS),
+        )
+
+    def get_hash_path(self, audio_hash: str) -> Optional[str]:
+        # Library file with this audio, None if unknown or since deleted
+        row = self.connection.execute(
+            'SELECT path FROM audio_hashes WHERE hash = ?',
+            (audio_hash,),
+        ).fetchone()
+        if row is None or not os.path.isfile(row[0]):
+            return None
+        return row[0]
+
+    def put_hash(self, audio_hash: str, file_path: str) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO audio_hashes VALUES (?, ?)',
+            (audio_hash, file_path),
+        )
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def invalidate(self, path_prefix: str = '') -> int:
+        # Drops every row under path_prefix (all rows by default)
+        cursor = self.connection.execute(
+            "DELETE FROM tags WHERE substr(path, 1, ?) = ?",
+            (len(path_prefix), path_prefix),
+        )
+        self.connection.execute(
+            "DELETE FROM audio_hashes WHERE substr(path, 1, ?) = ?",
+            (len(path_prefix), path_prefix),
+        )
+        self.connection.commit()
+        return cursor.rowcount
+
+    def compact(self) -> int:
+        # Drops rows for files that no longer exist, then shrinks the file
+        missing = [
+            (path,)
+            for (path,) in self.connection.execute('SELECT path FROM tags')
+            if not os.path.isfile(path)
+        ]
+        self.connection.executemany('DELETE FROM tags WHERE path = ?', missing)
+        self.connection.executemany(
+            'DELETE FROM audio_hashes WHERE path = ?',
+            [
+                (path,)
+                for (path,) in self.connection.execute(
+                    'SELECT path FROM audio_hashes'
+                ).fetchall()
+                if not os.path.isfile(path)
+            ],
+        )
+        self.connection.commit()
+        self.connection.execute('VACUUM')
+        return len(missing)
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,245 @@
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+from typing import Dict, Iterable, Iterator, List, Optional, TypeVar
+
+# Latency histogram upper bounds in seconds, Prometheus style (+Inf implied)
+HISTOGRAM_BOUNDS = [
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0,
+]
+TRACEMALLOC_FRAMES = 1
+
+T = TypeVar('T')
+
+
+class StageStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0  # Exclusive, nested stages are not counted twice
+        self.bucket_counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+
+class RunMetrics:
+    """
+    Per-stage timers, counters and latency histograms for one run, written
+    as JSON or as a Prometheus textfile (node_exporter textfile collector).
+
+    Stages nest per thread: time spent in an inner stage is subtracted from
+    the outer one, so stage totals add up to the instrumented wall time.
+
+    NOTE: Safe to share between threads (copy workers record 'copy')
+    NOTE: Costs two perf_counter calls and a lock per stage, cheap next to
+          the file I/O it measures
+    """
+    def __init__(self, name: str) -> None:
+        """
+        :param name: metric name prefix, e.g. 'mp3_file_sorter'
+        """
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        stack = self._get_stack()
+        stack.append(0.0)  # Time spent in nested stages
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                stats = self.stages.get(name)
+                if stats is None:
+                    stats = self.stages[name] = StageStats()
+                stats.observe(elapsed - nested)
+
+    def timed_iter(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        # Times each next() of items as stage name, e.g. a lazy scan
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'name': self.name,
+                'wall_seconds': time.perf_counter() - self.start_time,
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'stages': {
+                    name: {
+                        'calls': s.calls,
+                        'seconds': s.seconds,
+                        'histogram': dict(zip(
+                            [str(b) for b in HISTOGRAM_BOUNDS] + ['+Inf'],
+                            s.bucket_counts,
+                        )),
+                    }
+                    for name, s in self.stages.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        data = self.to_dict()
+        prefix = self.name
+        lines = [
+            f'# TYPE {prefix}_wall_seconds gauge',
+            f'{prefix}_wall_seconds {data["wall_seconds"]:.6f}',
+        ]
+        for name, value in sorted(data['counters'].items()):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        for name, value in sorted(data['gauges'].items()):
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {value}')
+
+        histogram = f'{prefix}_stage_seconds'
+        lines.append(f'# TYPE {histogram} histogram')
+        with self._lock:
+            stages = sorted(self.stages.items())
+            for stage, stats in stages:
+                cumulative = 0
+                bounds = [str(b) for b in HISTOGRAM_BOUNDS] + ['+Inf']
+                for bound, bucket_count in zip(bounds, stats.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{histogram}_bucket{{stage="{stage}",le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'{histogram}_sum{{stage="{stage}"}} {stats.seconds:.6f}')
+                lines.append(f'{histogram}_count{{stage="{stage}"}} {stats.calls}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path: str) -> None:
+        # Atomic, the textfile collector must never read a partial file
+        _write_atomic(path, self.to_prometheus())
+
+    def get_summary_str(self) -> str:
+        data = self.to_dict()
+        lines = [f'{self.name}: {data["wall_seconds"]:.2f}s']
+        for name, stats in sorted(
+            data['stages'].items(),
+            key=lambda item: -item[1]['seconds'],
+        ):
+            lines.append(
+                f'  {name}: {stats["seconds"]:.2f}s in {stats["calls"]} calls'
+            )
+        for name, value in sorted(data['counters'].items()):
+            lines.append(f'  {name}: {value:,.0f}')
+        return '\n'.join(lines)
+
+    def _get_stack(self) -> List[float]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+@contextlib.contextmanager
+def profile_run(
+        metrics: RunMetrics,
+        profile_path: Optional[str] = None,
+        trace_memory: bool = False
+    ) -> Iterator[None]:
+    """
+    Optional cProfile and tracemalloc hooks around a run
+
+    :param metrics: receives the 'tracemalloc_peak_bytes' gauge
+    :param profile_path: cProfile stats file (read with pstats or snakeviz)
+    :param trace_memory: record the peak Python heap size
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if trace_memory:
+            metrics.set_gauge('tracemalloc_peak_bytes', tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser) -> None:
+    # Shared CLI options, see write_metrics
+    parser.add_argument(
+        '--metrics-json',
+        help='write stage timings, counters and histograms to this JSON file',
+    )
+    parser.add_argument(
+        '--metrics-prom',
+        help='write the metrics in Prometheus textfile format to this file',
+    )
+    parser.add_argument(
+        '--profile',
+        help='write cProfile stats of the run to this file',
+    )
+    parser.add_argument(
+        '--trace-memory',
+        action='store_true',
+        help='record the peak Python heap size with tracemalloc',
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='print a line per file instead of only errors and a summary',
+    )
+
+
+def write_metrics(metrics: RunMetrics, args: argparse.Namespace) -> None:
+    # Prints the summary and writes the files asked for on the command line
+    print(metrics.get_summary_str())
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+
+
+def _write_atomic(path: str, text: str) -> None:
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
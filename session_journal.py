@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+from typing import Dict, Optional
+
+DEFAULT_JOURNAL_FILE_NAME = '.image_bucket_journal.jsonl'
+FSYNC_EVERY = 20  # Decisions between fsyncs
+FSYNC_INTERVAL = 2.0  # Seconds, an older unsynced decision forces an fsync
+ROTATED_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+
+class SessionJournal:
+    """
+    Append-only JSONL journal of (image, bucket) decisions, one per line,
+    fsynced in batches so a crash loses at most the last few decisions.
+
+    A null bucket records an undone decision, the last line for an image
+    wins when the journal is read back.
+
+    NOTE: A torn last line (crash mid-write) is ignored when reading
+    """
+    def __init__(self, journal_path: str, resume: bool = False) -> None:
+        """
+        :param journal_path: journal file path
+        :param resume: keep appending to an existing journal, otherwise it is
+                       kept as get_rotated_path() and a new one started
+        """
+        self.journal_path = journal_path
+        self.rotated_path = None
+        if not resume and os.path.exists(journal_path):
+            self.rotated_path = get_rotated_path(journal_path)
+            os.rename(journal_path, self.rotated_path)
+        self._file = open(journal_path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def record(self, image: str, bucket: Optional[str]) -> None:
+        self._file.write(json.dumps({'image': image, 'bucket': bucket}) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        self.sync_if_due()
+
+    def sync_if_due(self) -> None:
+        if self._unsynced == 0:
+            return
+        overdue = time.monotonic() - self._last_sync >= FSYNC_INTERVAL
+        if self._unsynced >= FSYNC_EVERY or overdue:
+            self.sync()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+def get_rotated_path(journal_path: str) -> str:
+    # '<journal_path>.<YYYYmmdd-HHMMSS>[.n].old', never an existing file, so
+    # no earlier session's decisions are overwritten
+    stamp = time.strftime(ROTATED_TIME_FORMAT)
+    rotated_path = f'{journal_path}.{stamp}.old'
+    copy_number = 1
+    while os.path.exists(rotated_path):
+        copy_number += 1
+        rotated_path = f'{journal_path}.{stamp}.{copy_number}.old'
+    return rotated_path
+
+
+def read_journal(journal_path: str) -> Dict[str, str]:
+    """
+    Reads the decisions of a previous session
+
+    :param journal_path: journal file path
+    :return: {image: bucket} for every image still assigned, {} if missing
+    """
+    decisions = {}
+    if not os.path.isfile(journal_path):
+        return decisions
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('bucket') is None:
+                decisions.pop(entry.get('image'), None)
+            else:
+                decisions[entry['image']] = entry['bucket']
+    return decisions
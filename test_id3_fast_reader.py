@@ -0,0 +1,33 @@
+import pytest
+
+mutagen_id3 = pytest.importorskip('mutagen.id3')
+
+from id3_fast_reader import read_sort_frames
+from mp3_file_sorter import read_sort_tags
+
+GENRES = ['Rock', 'Rock and Roll', '17', '(17)', '(17)Rock', 'RX', 'CR', '(RX)', '(CR)']
+
+
+def write_mp3(path: str, genre: str, v2_version: int) -> None:
+    tag = mutagen_id3.ID3()
+    tag.add(mutagen_id3.TCON(encoding=3, text=[genre]))
+    tag.add(mutagen_id3.TPE1(encoding=3, text=['Band']))
+    tag.add(mutagen_id3.TALB(encoding=3, text=['Album']))
+    tag.save(path, v2_version=v2_version)
+    with open(path, 'ab') as f:
+        f.write(b'\xff\xfb' + b'\x00' * 512)
+
+
+@pytest.mark.parametrize('v2_version', [3, 4])
+@pytest.mark.parametrize('genre', GENRES)
+def test_fast_tags_match_mutagen(tmp_path, genre, v2_version):
+    path = str(tmp_path / 'a.mp3')
+    write_mp3(path, genre, v2_version)
+    assert read_sort_tags(path, fast=True) == read_sort_tags(path, fast=False)
+
+
+@pytest.mark.parametrize('genre', ['RX', 'CR', '17', '(17)'])
+def test_genre_references_fall_back(tmp_path, genre):
+    path = str(tmp_path / 'a.mp3')
+    write_mp3(path, genre, 4)
+    assert read_sort_frames(path) is None
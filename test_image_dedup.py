@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('PIL')
+
+from image_dedup import HASH_BITS, MultiIndexHash
+
+
+def flip_one_bit_per_chunk(image_hash: int, chunks: list) -> int:
+    # Worst case for the index: one differing bit in each of these chunks
+    for shift, _ in chunks:
+        image_hash ^= 1 << shift
+    return image_hash
+
+
+@pytest.mark.parametrize('max_distance', range(HASH_BITS))
+def test_worst_case_within_distance_is_found(max_distance):
+    index = MultiIndexHash(max_distance)
+    assert len(index._chunks) == max_distance + 1
+    stored = random.Random(max_distance).getrandbits(HASH_BITS)
+    index.add(stored, 'original')
+
+    # Every chunk but the last differs, max_distance bits in total
+    query = flip_one_bit_per_chunk(stored, index._chunks[:-1])
+    assert (query ^ stored).bit_count() == max_distance
+    assert index.find(query) == 'original'
+
+    # One more differing bit is beyond max_distance
+    query = flip_one_bit_per_chunk(stored, index._chunks)
+    assert index.find(query) is None
+
+
+def test_matches_brute_force():
+    rng = random.Random(0)
+    for max_distance in [0, 4, 8, 13, 31, 64]:
+        index = MultiIndexHash(max_distance)
+        stored = [rng.getrandbits(HASH_BITS) for _ in range(200)]
+        for i, image_hash in enumerate(stored):
+            index.add(image_hash, str(i))
+        for _ in range(200):
+            query = stored[rng.randrange(len(stored))]
+            for bit in rng.sample(range(HASH_BITS), rng.randint(0, max_distance)):
+                query ^= 1 << bit
+            best = min((query ^ h).bit_count() for h in stored)
+            found = index.find(query)
+            if best > max_distance:
+                assert found is None
+            else:
+                assert (query ^ stored[int(found)]).bit_count() == best
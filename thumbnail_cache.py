@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+import time
+
+from PIL import Image, PngImagePlugin
+from typing import Optional, Tuple
+
+DEFAULT_THUMBNAIL_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'image_bucket_sorter'
+)
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+ORIGINAL_SIZE_KEY = 'original_size'  # PNG text chunk, '<width>x<height>'
+PNG_COMPRESS_LEVEL = 1  # Favors fast writes over small files
+STALE_TEMP_SECONDS = 60 * 60  # Older temporary files were left by a crash
+
+
+class ThumbnailCache:
+    """
+    Persistent cache of scaled images, one PNG per (path, size, mtime,
+    bounds), so reopening a partly sorted folder skips decoding.
+
+    NOTE: Entries are written to a temporary file and renamed, a crash never
+          leaves a half written thumbnail
+    NOTE: Stale entries are never read, prune() removes the least recently
+          used entries (by mtime, hits touch it) beyond max_bytes on start
+    NOTE: Images that are not downscaled are never cached, decoding the
+          source costs about as much as decoding a PNG of the same size
+    """
+    def __init__(
+            self,
+            cache_dir: str,
+            max_width: int,
+            max_height: int,
+            max_bytes: int = DEFAULT_MAX_CACHE_BYTES
+        ) -> None:
+        self.cache_dir = cache_dir
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.prune()
+
+    def get(
+            self,
+            file_path: str,
+            stat: os.stat_result
+        ) -> Optional[Tuple[Tuple[int, int], Image.Image]]:
+        # Returns ((original width, original height), scaled image) or None
+        thumbnail_path = self._get_thumbnail_path(file_path, stat)
+        try:
+            with Image.open(thumbnail_path) as thumbnail:
+                thumbnail.load()
+                width, height = thumbnail.text[ORIGINAL_SIZE_KEY].split('x')
+                cached = (int(width), int(height)), thumbnail.copy()
+        except (OSError, KeyError, ValueError):  # Missing or unreadable
+            return None
+        try:
+            os.utime(thumbnail_path)  # Recently used, pruned last
+        except OSError:
+            pass
+        return cached
+
+    def put(
+            self,
+            file_path: str,
+            stat: os.stat_result,
+            size: Tuple[int, int],
+            image: Image.Image
+        ) -> None:
+        if image.width >= size[0] and image.height >= size[1]:
+            return  # Not downscaled
+        thumbnail_path = self._get_thumbnail_path(file_path, stat)
+        # Unique per thread, prefetch workers may write the same entry
+        temp_path = (
+            f'{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        )
+        info = PngImagePlugin.PngInfo()
+        info.add_text(ORIGINAL_SIZE_KEY, f'{size[0]}x{size[1]}')
+        if image.mode not in ('1', 'L', 'LA', 'I', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGB')  # CMYK and others cannot be PNG
+        try:
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            image.save(
+                temp_path,
+                'PNG',
+                pnginfo=info,
+                compress_level=PNG_COMPRESS_LEVEL,
+            )
+            os.replace(temp_path, thumbnail_path)
+        except OSError:  # Cache is best effort
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def prune(self) -> int:
+        """
+        Removes the least recently used entries until the cache fits in
+        max_bytes, and temporary files left by a crash
+
+        :return: number of files removed
+        """
+        entries = []  # (mtime, size, path)
+        removed = 0
+        stale_temp_time = time.time() - STALE_TEMP_SECONDS
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(sub_dir.path):
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    if entry.name.endswith('.tmp'):
+                        if stat.st_mtime > stale_temp_time:
+                            continue  # Possibly still written by another run
+                        os.remove(entry.path)
+                        removed += 1
+                    elif entry.name.endswith('.png'):
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:  # Removed by another run, best effort
+                    continue
+
+        total_bytes = sum(e[1] for e in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            removed += 1
+        return removed
+
+    def _get_thumbnail_path(self, file_path: str, stat: os.stat_result) -> str:
+        key = (
+            f'{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|'
+            f'{self.max_width}x{self.max_height}'
+        )
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.png')